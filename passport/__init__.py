@@ -1,5 +1,6 @@
 from passport.loggers import *
 from passport.rwts import *
+from passport.rwts.decoder import decode_memo
 from passport.patchers import *
 from passport.strings import *
 from passport.constants import *
@@ -12,6 +13,19 @@ import os.path
 import time
 
 class PassportGlobals:
+    __slots__ = ("is_boot0", "is_boot1", "is_master", "is_rwts", "is_dos32",
+                 "is_prodos", "is_dinkeydos", "is_pascal", "is_protdos",
+                 "is_daviddos", "is_ea", "possible_gamco", "is_optimum",
+                 "is_mecc_fastloader", "mecc_variant", "possible_d5d5f7",
+                 "is_8b3", "is_milliken1", "is_adventure_international",
+                 "is_laureate", "is_datasoft", "is_micrograms", "is_quickdos",
+                 "is_rdos", "is_sierra", "is_sierra13", "is_f7f6",
+                 "is_trillium", "polarware_tamper_check", "force_disk_vol",
+                 "captured_disk_volume_number", "disk_volume_number",
+                 "found_and_cleaned_weakbits", "cleaned_weakbits",
+                 "protection_enforces_write_protected", "tried_univ", "track",
+                 "sector", "last_track", "filename", "disk_image", "logger")
+
     def __init__(self):
         # things about the disk
         self.is_boot0 = False
@@ -35,6 +49,9 @@ class PassportGlobals:
         self.is_adventure_international = False
         self.is_laureate = False
         self.is_datasoft = False
+        self.is_micrograms = False
+        self.is_quickdos = False
+        self.is_rdos = False
         self.is_sierra = False
         self.is_sierra13 = False
         self.is_f7f6 = False
@@ -44,6 +61,7 @@ class PassportGlobals:
         self.captured_disk_volume_number = False
         self.disk_volume_number = None
         self.found_and_cleaned_weakbits = False
+        self.cleaned_weakbits = [] # (logical track, bit index, bit count) of each range of bits cleaned
         self.protection_enforces_write_protected = False
         # things about the conversion process
         self.tried_univ = False
@@ -51,6 +69,8 @@ class PassportGlobals:
         self.sector = 0 # display purposes only
         self.last_track = 0
         self.filename = None
+        self.disk_image = None
+        self.logger = None
 
 class BasePassportProcessor: # base class
     def __init__(self, filename, disk_image, logger_class=DefaultLogger):
@@ -135,10 +155,19 @@ class BasePassportProcessor: # base class
             #TrilliumPatcher,
             ]
         self.burn = 0
+        self.scan_budget = None # bits each track may scan (None for wozardry.kScanBudgetRevolutions revolutions)
+        self.vote = False # vote on sectors that don't read cleanly from any one revolution (see RWTS.vote_sectors)
         if self.preprocess():
             if self.run():
                 self.postprocess()
 
+    def UniversalRWTSClasses(self):
+        """returns (universal, ignoring epilogues) built-in RWTS classes that
+        run() falls back to for this disk's kind of sectors"""
+        if self.g.is_dos32:
+            return (UniversalDOS32RWTS, UniversalDOS32RWTSIgnoreEpilogues)
+        return (UniversalRWTS, UniversalRWTSIgnoreEpilogues)
+
     def SkipTrack(self, logical_track_num, track):
         # don't look for whole-track protections on track 0, that's silly
         if logical_track_num == 0: return False
@@ -146,26 +175,30 @@ class BasePassportProcessor: # base class
         if not track.bits:
             self.g.logger.PrintByID("unformat")
             return True
+        # everything below is a lookup in the track's statistics, which are
+        # worked out once and don't move the track
+        stats = track_stats(track)
+        decoder = self.rwts.decoder()
         # Electronic Arts protection track?
         if logical_track_num == 6:
-            if self.rwts.find_address_prologue(track):
-                address_field = self.rwts.address_field_at_point(track)
-                if address_field and address_field.track_num == 5: return True
-        # Nibble count track?
-        repeated_nibble_count = 0
-        start_revolutions = track.revolutions
-        last_nibble = 0x00
-        while (repeated_nibble_count < 512 and track.revolutions < start_revolutions + 2):
-            n = next(track.nibble())
-            if n == last_nibble:
-                repeated_nibble_count += 1
-            else:
-                repeated_nibble_count = 0
-            last_nibble = n
-        if repeated_nibble_count == 512:
+            if [track_num for track_num, sector_num in stats.address_fields(decoder.address_prologues) if track_num == 5]:
+                return True
+        # Nibble count track? (513 of the same nibble in a row, any nibble
+        # value, which is also how a long run of self-sync nibbles reads)
+        if stats.longest_run() >= 513:
             self.g.logger.PrintByID("sync")
             return True
-        # TODO IsUnformatted nibble test and other tests
+        # Unformatted track? (no address fields, and about as many invalid
+        # nibbles as the random noise a drive reads from a blank track,
+        # measured with the built-in RWTS's standard prologues and translate
+        # table rather than ones the disk supplied, so the same track always
+        # gets the same answer)
+        standard = self.UniversalRWTSClasses()[0](self.g).decoder()
+        if not stats.address_field_count(standard.address_prologues) and \
+           stats.valid_ratio(standard.translate_table) < kUnformattedValidRatio:
+            self.g.logger.PrintByID("unformat")
+            return True
+        # TODO other tests
         # (still need these for disks like Crime Wave and Thunder Bombs)
         return False
 
@@ -399,10 +432,37 @@ class BasePassportProcessor: # base class
                                           "AD 78 04"
                                           "90 2B"))
 
+    def ID13Sector(self, t00):
+        """returns True if track 0 has 13-sector address prologues and no
+        16-sector ones, without moving |t00|"""
+        if not t00 or not t00.bits: return False
+        return t00.view().find(DOS32RWTS.kDefaultAddressPrologue13) and \
+            not t00.view().find_any(UniversalRWTS.acceptable_address_prologues)
+
     def IDBootloader(self, t00, suppress_errors=False):
         """returns RWTS object that can (hopefully) read the rest of the disk"""
+        # 13-sector disks don't have a single sector any 16-sector RWTS can
+        # read, so check for them before trying
+        if self.ID13Sector(t00):
+            rwts = DOS32RWTS(self.g)
+            mark = t00.mark()
+            try:
+                physical_sectors = rwts.decode_track(t00, 0)
+            except wozardry.ScanBudgetExceeded as e:
+                self.g.logger.debug("giving up on track 0x0: %s" % e)
+                physical_sectors = {}
+            # either way, whatever reads track 0 next starts where this did
+            t00.restore(mark)
+            if 0 in physical_sectors:
+                self.g.is_dos32 = True
+                self.g.logger.PrintByID("dos32boot0")
+                return rwts
         temporary_rwts_for_t00 = Track00RWTS(self.g)
-        physical_sectors = temporary_rwts_for_t00.decode_track(t00, 0)
+        try:
+            physical_sectors = temporary_rwts_for_t00.decode_track(t00, 0)
+        except wozardry.ScanBudgetExceeded as e:
+            self.g.logger.debug("giving up on track 0x0: %s" % e)
+            physical_sectors = {}
         if 0 not in physical_sectors:
             if not suppress_errors:
                 self.g.logger.PrintByID("fail")
@@ -438,9 +498,7 @@ class BasePassportProcessor: # base class
             self.g.logger.PrintByID("laureate")
             return LaureateRWTS(logical_sectors, self.g)
         # TODO Electronic Arts
-        # TODO DOS 3.2
         # TODO IDEncoded44
-        # TODO IDEncoded53
         self.g.is_prodos = self.IDProDOS(t00s00)
         if self.g.is_prodos:
             # TODO IDVolumeName
@@ -581,10 +639,12 @@ class BasePassportProcessor: # base class
         # get raw track $00 data from the source disk
         self.tracks = {}
         self.tracks[0] = self.g.disk_image.seek(0)
+        self.tracks[0].start_scan_budget(self.scan_budget)
         # analyze track $00 to create an RWTS
         self.rwts = self.IDBootloader(self.tracks[0], supports_reseek)
         if not self.rwts and supports_reseek:
             self.tracks[0] = self.g.disk_image.reseek(0)
+            self.tracks[0].start_scan_budget(self.scan_budget)
             self.rwts = self.IDBootloader(self.tracks[0])
         if not self.rwts: return False
 
@@ -604,47 +664,62 @@ class BasePassportProcessor: # base class
             # self.tracks must be indexed by physical track number so we can write out
             # .woz files correctly
             self.tracks[physical_track_num] = self.g.disk_image.seek(physical_track_num)
+            self.tracks[physical_track_num].start_scan_budget(self.scan_budget)
 
             tried_reseek = False
             physical_sectors = OrderedDict()
-            while True:
-                physical_sectors.update(self.rwts.decode_track(self.tracks[physical_track_num], logical_track_num, self.burn))
-                if self.rwts.enough(logical_track_num, physical_sectors):
-                    break
-
-                if supports_reseek and not tried_reseek:
-                    self.tracks[physical_track_num] = self.g.disk_image.reseek(physical_track_num)
-                    self.g.logger.debug("Reseeking to track %s" % hex(self.g.track))
-                    tried_reseek = True
-                    continue
-
-                self.g.logger.debug("found %d sectors" % len(physical_sectors))
-                if (0x0F not in physical_sectors) and self.SkipTrack(logical_track_num, self.tracks[physical_track_num]):
-                    physical_sectors = None
-                    break
-
-                if self.g.tried_univ:
-                    if logical_track_num == 0x22 and (0x0F not in physical_sectors):
-                        self.g.logger.PrintByID("fail", {"sector":0x0F})
-                        self.g.logger.PrintByID("fatal220f")
-                        return False
-                else:
-                    transition_sector = 0x0F
-                    if physical_sectors:
-                        temp_logical_sectors = self.rwts.reorder_to_logical_sectors(physical_sectors)
-                        transition_sector = min(temp_logical_sectors.keys())
-                    self.g.logger.PrintByID("switch", {"sector":transition_sector})
-                    self.rwts = UniversalRWTS(self.g)
-                    self.g.tried_univ = True
-                    continue
-
-                if logical_track_num == 0 and type(self.rwts) != UniversalRWTSIgnoreEpilogues:
-                    self.rwts = UniversalRWTSIgnoreEpilogues(self.g)
-                    continue
-
+            try:
+                while True:
+                    physical_sectors.update(self.rwts.decode_track(self.tracks[physical_track_num], logical_track_num, self.burn, self.vote))
+                    if self.rwts.enough(logical_track_num, physical_sectors):
+                        break
+
+                    if supports_reseek and not tried_reseek:
+                        self.tracks[physical_track_num] = self.g.disk_image.reseek(physical_track_num)
+                        self.tracks[physical_track_num].start_scan_budget(self.scan_budget)
+                        self.g.logger.debug("Reseeking to track %s" % hex(self.g.track))
+                        tried_reseek = True
+                        continue
+
+                    self.g.logger.debug("found %d sectors" % len(physical_sectors))
+                    # last physical sector ($0F, or $0C on a 13-sector disk)
+                    last_sector = self.rwts.sectors_per_track - 1
+                    if (last_sector not in physical_sectors) and self.SkipTrack(logical_track_num, self.tracks[physical_track_num]):
+                        physical_sectors = None
+                        break
+
+                    if self.g.tried_univ:
+                        if logical_track_num == 0x22 and (last_sector not in physical_sectors):
+                            self.g.logger.PrintByID("fail", {"sector":last_sector})
+                            self.g.logger.PrintByID("fatal220f")
+                            return False
+                    else:
+                        transition_sector = self.rwts.sectors_per_track - 1
+                        if physical_sectors:
+                            temp_logical_sectors = self.rwts.reorder_to_logical_sectors(physical_sectors)
+                            transition_sector = min(temp_logical_sectors.keys())
+                        self.g.logger.PrintByID("switch", {"sector":transition_sector})
+                        # the built-in RWTSes share the track's SectorDirectory with
+                        # the one that just failed, so trying them doesn't traverse
+                        # or decode the track again
+                        self.rwts = self.UniversalRWTSClasses()[0](self.g)
+                        self.g.tried_univ = True
+                        continue
+
+                    if logical_track_num == 0 and type(self.rwts) != self.UniversalRWTSClasses()[1]:
+                        self.rwts = self.UniversalRWTSClasses()[1](self.g)
+                        continue
+
+                    self.g.logger.PrintByID("fail")
+                    return False
+            except wozardry.ScanBudgetExceeded as e:
+                # every RWTS that could still be tried would be reading the
+                # same track on the same budget, so there's no point
+                self.g.logger.debug("giving up on track %s: %s" % (hex(self.g.track), e))
                 self.g.logger.PrintByID("fail")
                 return False
             self.save_track(physical_track_num, logical_track_num, physical_sectors)
+        self.g.logger.debug("decode memo: %d hits, %d misses (%.1f%%)" % (decode_memo.hits, decode_memo.misses, 100 * decode_memo.hit_rate()))
         return True
 
     def save_track(self, physical_track_num, logical_track_num, physical_sectors):
@@ -695,7 +770,7 @@ class Crack(Verify):
                 self.g.logger.PrintByID(patch.id, patch.params)
             if len(patch.new_value) > 0:
                 b = logical_sectors[patch.sector_num].decoded
-                patch.params["old_value"] = b[patch.byte_offset:patch.byte_offset+len(patch.new_value)]
+                patch.params["old_value"] = bytes(b[patch.byte_offset:patch.byte_offset+len(patch.new_value)])
                 patch.params["new_value"] = patch.new_value
                 self.g.logger.PrintByID("modify", patch.params)
                 for i in range(len(patch.new_value)):
@@ -704,14 +779,16 @@ class Crack(Verify):
 
     def postprocess(self):
         source_base, source_ext = os.path.splitext(self.g.filename)
-        output_filename = source_base + '.dsk'
+        # 13-sector disks are written as .d13 images, 13 sectors per track
+        sectors_per_track = self.g.is_dos32 and 13 or 16
+        output_filename = source_base + (self.g.is_dos32 and '.d13' or '.dsk')
         self.g.logger.PrintByID("writing", {"filename":output_filename})
         with open(output_filename, "wb") as f:
             for logical_track_num in range(0x23):
                 if logical_track_num in self.output_tracks:
-                    f.write(concat_track(self.output_tracks[logical_track_num]))
+                    f.write(concat_track(self.output_tracks[logical_track_num], sectors_per_track))
                 else:
-                    f.write(bytes(256*16))
+                    f.write(bytes(256*sectors_per_track))
         if self.patches_found:
             self.g.logger.PrintByID("passcrack")
         else:
@@ -727,10 +804,19 @@ class Convert(BasePassportProcessor):
         if physical_sectors:
             b = bitarray.bitarray(endian="big")
             for s in physical_sectors.values():
-                b.extend(track.bits[s.start_bit_index:s.end_bit_index])
+                # sectors that straddle the splice point are contiguous in
+                # the unrolled bitstream
+                b.extend(track.slice(s.start_bit_index, s.end_bit_index))
         else:
             # TODO call wozify here instead
-            b = track.bits[:51021]
+            runs = track.sync_runs()
+            if runs:
+                # start at the longest run of self-sync nibbles, so the splice
+                # point falls just before it
+                bit_index, count = max(runs, key=lambda run: run[1])
+                b = track.slice(bit_index, bit_index + min(51021, track.bit_count))
+            else:
+                b = track.bits[:51021]
         # output_tracks is indexed on physical track number here because the
         # point of .woz is to capture the physical layout of the original disk
         self.output_tracks[physical_track_num] = wozardry.Track(b, len(b))
@@ -746,7 +832,7 @@ class Convert(BasePassportProcessor):
         root = [x for x in j.keys()].pop()
         woz_image.info["creator"] = STRINGS["header"].strip()[:32]
         woz_image.info["synchronized"] = j[root]["info"]["synchronized"]
-        woz_image.info["cleaned"] = True #self.g.found_and_cleaned_weakbits
+        woz_image.info["cleaned"] = self.g.found_and_cleaned_weakbits or j[root]["info"].get("cleaned", False)
         woz_image.info["write_protected"] = self.g.protection_enforces_write_protected or j[root]["info"]["write_protected"]
         woz_image.meta["image_date"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
         for q in range(1 + (0x23 * 4)):
@@ -2,6 +2,10 @@ from passport.wozardry import Track, raise_if
 from passport import a2rchery
 import bitarray
 import collections
+try:
+    import numpy # optional, makes to_bits() much faster
+except ImportError:
+    numpy = None
 
 class A2RSeekError(a2rchery.A2RError): pass
 
@@ -21,11 +25,17 @@ class A2RImage:
             return bits
         fluxxen = flux_record["data"][1:]
         if not self.speed:
-            speeds = [(len([1 for i in fluxxen[:8192] if i%t==0]), t) for t in range(0x1e,0x23)]
+            # the tick count that divides the most of the first 8192 flux
+            # timings (the larger one, if there's a tie), counted from one
+            # histogram of them
+            histogram = collections.Counter(fluxxen[:8192])
+            speeds = [(sum([histogram[i] for i in range(0, 0x100, t)]), t) for t in range(0x1e,0x23)]
             speeds.sort()
             self.speed = speeds[-1][1]
         speed = self.speed
         flux_total = flux_start = -speed//2
+        if numpy:
+            return self.to_bits_numpy(fluxxen, speed, flux_start)
         for flux_value in fluxxen:
             flux_total += flux_value
             if flux_value == 0xFF:
@@ -36,6 +46,29 @@ class A2RImage:
             flux_total = flux_start
         return bits
 
+    def to_bits_numpy(self, fluxxen, speed, flux_start):
+        """to_bits() for all of |fluxxen| at once, bit for bit the same. A flux
+        timing of 0xFF carries into the next one instead of being a
+        transition, so each transition's time is the total of the timings
+        since the last one (the difference between running totals), and it
+        comes out as that many bit cells of 0 (less half a cell, and none if
+        that's negative) and then a 1. Where each 1 lands is the running total
+        of those, so they're set in one go in an array of bits, which is packed
+        into a bitarray."""
+        bits = bitarray.bitarray()
+        fluxxen = numpy.frombuffer(fluxxen, dtype=numpy.uint8)
+        transitions = numpy.flatnonzero(fluxxen != 0xFF)
+        if not len(transitions):
+            return bits
+        totals = numpy.diff(numpy.cumsum(fluxxen, dtype=numpy.int64)[transitions], prepend=0)
+        zeros = numpy.maximum((totals + flux_start) // speed, 0)
+        ones = numpy.cumsum(zeros + 1) - 1
+        cells = numpy.zeros(int(ones[-1]) + 1, dtype=numpy.uint8)
+        cells[ones] = 1
+        bits.frombytes(numpy.packbits(cells).tobytes())
+        del bits[len(cells):]
+        return bits
+
     def seek(self, track_num):
         if type(track_num) != float:
             track_num = float(track_num)
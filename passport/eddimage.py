@@ -1,20 +1,70 @@
-from passport.wozardry import Track, raise_if
-import bitarray
+from passport.wozardry import Track, raise_if, read_stream, bits_from_buffer
 import json
+import re
 
 class EDDError(Exception): pass # base class
 class EDDLengthError(EDDError): pass
 class EDDSeekError(EDDError): pass
 
+# each track in an .edd file is a 131072-bit capture, about 2.5 revolutions
+kCaptureBits = 131072
+# range of plausible revolution lengths, in bits
+kMinRevolution = 40000
+kMaxRevolution = 60000
+# revolution detection looks for where short probes from the first
+# revolution turn up again, and needs most of the ones it could place (and
+# at least kMinProbes) to agree
+kProbeCount = 8
+kProbeBits = 64
+kProbeSpacing = 4096
+kProbeTolerance = 32
+kMinProbes = 3
+# run of at least 4 self-sync nibbles, where the track gets spliced
+kSyncRunPattern = re.compile("(?:1111111100){4,}")
+
+def find_revolution(bits):
+    """returns number of bits in one revolution of the disk in |bits|, or None
+    if the capture doesn't repeat clearly enough to tell (unformatted tracks,
+    mostly sync, etc.)"""
+    text = bits.to01()
+    periods = []
+    for i in range(kProbeCount):
+        # a probe that turns up more than once (like one inside a long run
+        # of sync nibbles, or a stretch of zero bits) says nothing about the
+        # period, so move it along until it's past that, as long as it
+        # stays before the next probe
+        for start in range(i * kProbeSpacing, (i + 1) * kProbeSpacing, kProbeBits):
+            probe = text[start:start + kProbeBits]
+            end = start + kMaxRevolution + kProbeBits
+            match = text.find(probe, start + kMinRevolution, end)
+            if match < 0: break
+            if text.find(probe, match + 1, end) < 0:
+                periods.append(match - start)
+                break
+    periods.sort()
+    best = []
+    for i in range(len(periods)):
+        group = [p for p in periods[i:] if p - periods[i] <= kProbeTolerance]
+        if len(group) > len(best):
+            best = group
+    if len(best) < kMinProbes or len(best) <= len(periods) // 2: return None
+    return best[len(best) // 2]
+
+def find_splice_point(bits, revolution):
+    """returns bit index in the middle of the longest run of self-sync nibbles
+    in the first revolution of |bits|, or 0 if there isn't one"""
+    runs = [m for m in kSyncRunPattern.finditer(bits[:revolution].to01())]
+    if not runs: return 0
+    m = max(runs, key=lambda m: m.end() - m.start())
+    return m.start() + ((m.end() - m.start()) // 20) * 10
+
 class EDDReader:
     def __init__(self, iostream):
-        self.tracks = []
-        for i in range(137):
-            raw_bytes = iostream.read(16384)
-            raise_if(len(raw_bytes) != 16384, EDDLengthError, "Bad EDD file (did you image by quarter tracks?)")
-            bits = bitarray.bitarray(endian="big")
-            bits.frombytes(raw_bytes)
-            self.tracks.append(Track(bits, 131072))
+        self.captures = []
+        self.tracks = {}
+        image = read_stream(iostream)
+        raise_if(len(image) < 137*16384, EDDLengthError, "Bad EDD file (did you image by quarter tracks?)")
+        self.captures = [bits_from_buffer(image[i*16384:(i+1)*16384]) for i in range(137)]
 
     def seek(self, track_num):
         if type(track_num) != float:
@@ -24,8 +74,20 @@ class EDDReader:
            track_num.as_integer_ratio()[1] not in (1,2,4):
             raise EDDSeekError("Invalid track %s" % track_num)
         trk_id = int(track_num * 4)
+        if trk_id not in self.tracks:
+            self.tracks[trk_id] = self.to_track(self.captures[trk_id])
         return self.tracks[trk_id]
 
+    def to_track(self, bits):
+        """returns Track of one revolution of the capture in |bits|, spliced in
+        a gap, so anything that reads "2 revolutions" reads 2 real ones, or of
+        the whole capture if we can't tell how long a revolution is"""
+        revolution = find_revolution(bits)
+        if not revolution:
+            return Track(bits, kCaptureBits)
+        start = find_splice_point(bits, revolution)
+        return Track(bits[start:start + revolution], revolution)
+
     def to_json(self):
         j = {"edd":
              {"info":
@@ -1,15 +1,25 @@
 class Patch:
     # represents a single patch that could be applied to a disk image
+    __slots__ = ("track_num", "sector_num", "byte_offset", "new_value", "id", "_extra_params", "_params")
+
     def __init__(self, track_num, sector_num, byte_offset, new_value, id=None, params={}):
         self.track_num = track_num
         self.sector_num = sector_num
         self.byte_offset = byte_offset
         self.new_value = new_value # (can be 0-length bytearray if this "patch" is really just an informational message with no changes)
         self.id = id # for logger.PrintByID (can be None)
-        self.params = params.copy()
-        self.params["track"] = track_num
-        self.params["sector"] = sector_num
-        self.params["offset"] = byte_offset
+        self._extra_params = params
+        self._params = None
+
+    @property
+    def params(self):
+        # built on first use, since most patches are never printed
+        if self._params is None:
+            self._params = self._extra_params.copy()
+            self._params["track"] = self.track_num
+            self._params["sector"] = self.sector_num
+            self._params["offset"] = self.byte_offset
+        return self._params
 
 class Patcher: # base class
     def __init__(self, g):
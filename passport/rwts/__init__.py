@@ -1,7 +1,10 @@
 from collections import OrderedDict
 from passport.util import *
+from passport.rwts.decoder import DataField, check_data_fields, compile_decoder, compile_translate_table, kEncoding62, vote_nibbles
 
 class AddressField:
+    __slots__ = ("volume", "track_num", "sector_num", "checksum", "valid")
+
     def __init__(self, volume, track_num, sector_num, checksum):
         self.volume = volume
         self.track_num = track_num
@@ -9,16 +12,107 @@ class AddressField:
         self.checksum = checksum
         self.valid = (volume ^ track_num ^ sector_num ^ checksum) == 0
 
+class SectorBuffer:
+    """one buffer for the decoded bytes of up to |sector_count| sectors read
+    from a track together, 256 bytes each. It isn't made until the first of
+    them is decoded."""
+    __slots__ = ("sector_count", "buffer")
+
+    def __init__(self, sector_count):
+        self.sector_count = sector_count
+        self.buffer = None
+
+    def view(self, slot):
+        """returns writable memoryview of the 256 bytes of |slot|"""
+        if self.buffer is None:
+            self.buffer = bytearray(256 * self.sector_count)
+        return memoryview(self.buffer)[256 * slot:256 * (slot + 1)]
+
 class Sector:
-    def __init__(self, address_field, decoded, start_bit_index=None, end_bit_index=None):
+    """a sector read from a track. |data_field| is what the RWTS read for it,
+    usually a DataField holding the raw nibbles and whether their checksum
+    is right, which isn't decoded until something reads .decoded (so tracks
+    that no patcher looks inside, and every track Convert reads but $00, are
+    only ever checked). It's decoded into |slot| of |buffer| (a
+    SectorBuffer shared by the sectors read from the track with it), or a
+    bytearray of its own if there isn't one or it's full. RWTSes that make
+    up their own data fields can pass the decoded bytes instead."""
+    __slots__ = ("address_field", "data_field", "_decoded", "start_bit_index", "end_bit_index", "buffer", "slot")
+
+    def __init__(self, address_field, data_field, start_bit_index=None, end_bit_index=None, buffer=None, slot=0):
         self.address_field = address_field
-        self.decoded = decoded
+        self.data_field = data_field
+        self._decoded = None
         self.start_bit_index = start_bit_index
         self.end_bit_index = end_bit_index
+        self.buffer = buffer
+        self.slot = slot
+
+    @property
+    def decoded(self):
+        """returns the 256 bytes in this sector (a memoryview of its slot in
+        its SectorBuffer, or a bytearray), decoding it the first time (each
+        sector has its own bytes, so patches to one don't show up in
+        another)"""
+        if self._decoded is None:
+            if isinstance(self.data_field, DataField):
+                if self.buffer is None or self.slot >= self.buffer.sector_count:
+                    self._decoded = bytearray(self.data_field.decode())
+                else:
+                    self._decoded = self.buffer.view(self.slot)
+                    self._decoded[:] = self.data_field.decode()
+            else:
+                self._decoded = self.data_field
+        return self._decoded
+
+    @decoded.setter
+    def decoded(self, decoded):
+        self._decoded = decoded
+
+    @property
+    def checksum_valid(self):
+        """returns True if the data field's checksum nibble is right, False if
+        it isn't, or None if the RWTS didn't read one"""
+        if isinstance(self.data_field, DataField):
+            return self.data_field.checksum_valid
+        return None
 
     def __getitem__(self, i):
         return self.decoded[i]
 
+class SectorQuirk:
+    """describes how an RWTS reads some sectors differently from standard DOS
+    3.3. RWTS.quirks is a list of these, and the first one that applies to
+    a sector is used for it.
+
+    |tracks| and |sectors| are the logical track numbers and physical
+    sector numbers it applies to (None for all).
+    |check_address_epilogue| is False to accept any address epilogue.
+    |after_data_prologue| is a sequence of (nibbles, bits) pairs to read
+    and then skip, in order, after finding the data prologue.
+    |fake_data_field| is True for a data field that is read but not
+    decoded, and comes out as all zeroes.
+    |data_epilogue_skip| is how many nibbles to read before the data
+    epilogue, or instead of it if |check_data_epilogue| is False."""
+    __slots__ = ("tracks", "sectors", "check_address_epilogue", "after_data_prologue",
+                 "fake_data_field", "data_epilogue_skip", "check_data_epilogue")
+
+    def __init__(self, tracks=None, sectors=None, check_address_epilogue=True, after_data_prologue=(),
+                 fake_data_field=False, data_epilogue_skip=0, check_data_epilogue=True):
+        self.tracks = tracks
+        self.sectors = sectors
+        self.check_address_epilogue = check_address_epilogue
+        self.after_data_prologue = after_data_prologue
+        self.fake_data_field = fake_data_field
+        self.data_epilogue_skip = data_epilogue_skip
+        self.check_data_epilogue = check_data_epilogue
+
+    def applies(self, logical_track_num, physical_sector_num):
+        return (self.tracks is None or logical_track_num in self.tracks) and \
+               (self.sectors is None or physical_sector_num in self.sectors)
+
+kNoQuirk = SectorQuirk()
+
 class RWTS:
     kDefaultSectorOrder16 =     (0x00, 0x07, 0x0E, 0x06, 0x0D, 0x05, 0x0C, 0x04, 0x0B, 0x03, 0x0A, 0x02, 0x09, 0x01, 0x08, 0x0F)
     kDefaultAddressPrologue16 = (0xD5, 0xAA, 0x96)
@@ -36,6 +130,10 @@ class RWTS:
         0xf7: 0x38, 0xf9: 0x39, 0xfa: 0x3a, 0xfb: 0x3b, 0xfc: 0x3c, 0xfd: 0x3d, 0xfe: 0x3e, 0xff: 0x3f,
     }
 
+    quirks = ()
+    # how data fields are encoded (see decoder.Encoding)
+    encoding = kEncoding62
+
     def __init__(self,
                  g,
                  sectors_per_track = 16,
@@ -52,6 +150,7 @@ class RWTS:
         self.data_epilogue = data_epilogue
         self.sector_order = sector_order
         self.nibble_translate_table = nibble_translate_table
+        self._decoder = None
         self.g = g
         self.logical_track_num = 0
 
@@ -59,75 +158,215 @@ class RWTS:
         self.logical_track_num = logical_track_num
         return float(logical_track_num)
 
+    def quirk(self, logical_track_num, physical_sector_num):
+        for quirk in self.quirks:
+            if quirk.applies(logical_track_num, physical_sector_num):
+                return quirk
+        return kNoQuirk
+
     def reorder_to_logical_sectors(self, physical_sectors):
         logical = {}
         for k, v in physical_sectors.items():
             logical[self.sector_order[k]] = v
         return logical
 
+    def address_prologues(self):
+        return (tuple(self.address_prologue),)
+
+    def decoder(self):
+        """returns the Decoder for this RWTS's current prologues, epilogues and
+        nibble translate table, only looking it up again when one of them has
+        been replaced since last time"""
+        sources = self.address_prologues() + (self.address_epilogue, self.data_prologue, self.data_epilogue, self.nibble_translate_table)
+        if self._decoder and len(sources) == len(self._decoder[0]) and \
+           all([a is b for a, b in zip(sources, self._decoder[0])]):
+            return self._decoder[1]
+        if self._decoder and self._decoder[0][-1] is self.nibble_translate_table:
+            translate_table = self._decoder[1].translate_table
+        else:
+            translate_table = compile_translate_table(self.nibble_translate_table)
+        decoder = compile_decoder(tuple([tuple(p) for p in self.address_prologues()]),
+                                  tuple(self.address_epilogue),
+                                  tuple(self.data_prologue),
+                                  tuple(self.data_epilogue),
+                                  translate_table,
+                                  self.encoding)
+        self._decoder = (sources, decoder)
+        return decoder
+
+    def directory(self, track):
+        """returns the SectorDirectory of |track| for this RWTS's data
+        prologue and nibble translate table, building it the first time any
+        RWTS asks for that combination"""
+        key = self.decoder().directory_key
+        directories = track.memo().setdefault("directories", {})
+        if key not in directories:
+            directories[key] = SectorDirectory(track, *key)
+        return directories[key]
+
     def find_address_prologue(self, track):
-        return track.find(self.address_prologue)
+        found = self.directory(track).find_address_prologue(track, self.decoder().address_prologues)
+        if found is None:
+            found = track.find_any(self.decoder().address_prologues)
+        return found
 
     def address_field_at_point(self, track):
-        volume = decode44(next(track.nibble()), next(track.nibble()))
-        track_num = decode44(next(track.nibble()), next(track.nibble()))
-        sector_num = decode44(next(track.nibble()), next(track.nibble()))
-        checksum = decode44(next(track.nibble()), next(track.nibble()))
+        address_field = self.directory(track).address_field_at_point(track)
+        if address_field: return address_field
+        nibbles = track.read_nibbles(8)
+        volume = decode44(nibbles[0], nibbles[1])
+        track_num = decode44(nibbles[2], nibbles[3])
+        sector_num = decode44(nibbles[4], nibbles[5])
+        checksum = decode44(nibbles[6], nibbles[7])
         return AddressField(volume, track_num, sector_num, checksum)
 
     def verify_nibbles_at_point(self, track, nibbles):
-        found = []
-        for i in nibbles:
-            found.append(next(track.nibble()))
-        return tuple(found) == tuple(nibbles)
+        return track.read_nibbles(len(nibbles)) == bytes(nibbles)
 
     def verify_address_epilogue_at_point(self, track, logical_track_num, physical_sector_num):
-        return self.verify_nibbles_at_point(track, self.address_epilogue)
+        if not self.quirk(logical_track_num, physical_sector_num).check_address_epilogue:
+            return True
+        return self.decoder().address_epilogue_at_point(track)
 
     def find_data_prologue(self, track, logical_track_num, physical_sector_num):
-        return track.find(self.data_prologue)
+        found = self.directory(track).find_data_prologue(track)
+        if found is None:
+            found = track.find(self.decoder().data_prologue)
+        if not found: return False
+        for nibble_count, bit_count in self.quirk(logical_track_num, physical_sector_num).after_data_prologue:
+            track.read_nibbles(nibble_count)
+            track.skip_bits(bit_count)
+        return True
 
     def data_field_at_point(self, track, logical_track_num, physical_sector_num):
-        disk_nibbles = []
-        for i in range(343):
-            disk_nibbles.append(next(track.nibble()))
-        checksum = 0
-        secondary = []
-        decoded = []
-        for i in range(86):
-            n = disk_nibbles[i]
-            if n not in self.nibble_translate_table: return None
-            b = self.nibble_translate_table[n]
-            if b >= 0x80: return None
-            checksum ^= b
-            secondary.insert(0, checksum)
-        for i in range(86, 342):
-            n = disk_nibbles[i]
-            if n not in self.nibble_translate_table: return None
-            b = self.nibble_translate_table[n]
-            if b >= 0x80: return None
-            checksum ^= b
-            decoded.append(checksum << 2)
-        n = disk_nibbles[i]
-        if n not in self.nibble_translate_table: return None
-        b = self.nibble_translate_table[n]
-        if b >= 0x80: return None
-        checksum ^= b
-        for i in range(86):
-            low2 = secondary[85 - i]
-            decoded[i] += (((low2 & 0b000001) << 1) + ((low2 & 0b000010) >> 1))
-            decoded[i + 86] += (((low2 & 0b000100) >> 1) + ((low2 & 0b001000) >> 3))
-            if i < 84:
-                decoded[i + 172] += (((low2 & 0b010000) >> 3) + ((low2 & 0b100000) >> 5))
-        return bytearray(decoded)
+        if self.quirk(logical_track_num, physical_sector_num).fake_data_field:
+            track.read_nibbles(self.encoding.field_length)
+            return bytearray(256)
+        return self.directory(track).data_field_at_point(track)
 
     def verify_data_epilogue_at_point(self, track, logical_track_num, physical_sector_num):
-        return self.verify_nibbles_at_point(track, self.data_epilogue)
+        quirk = self.quirk(logical_track_num, physical_sector_num)
+        if quirk.data_epilogue_skip:
+            track.read_nibbles(quirk.data_epilogue_skip)
+        if not quirk.check_data_epilogue:
+            return True
+        return self.decoder().data_epilogue_at_point(track)
+
+    def reads_standard_sectors(self):
+        """returns True if this RWTS reads every sector with RWTS's own hooks
+        and no quirks, so decode_standard_track() can read its tracks"""
+        return not self.quirks and \
+            all([getattr(type(self), hook) is getattr(RWTS, hook) for hook in
+                 ("find_address_prologue", "address_field_at_point", "verify_address_epilogue_at_point",
+                  "find_data_prologue", "data_field_at_point", "verify_data_epilogue_at_point")])
+
+    def decode_standard_track(self, track, logical_track_num, burn=0, vote=False):
+        """decode_track() for an RWTS that reads_standard_sectors(), straight
+        from the SectorDirectory of a track where every sector reads cleanly
+        (which is most of them, even on protected disks). Returns None
+        without moving if any sector on the way would have taken
+        decode_track() down one of its other paths (a bad epilogue or data
+        field, a duplicate sector, running out of track, a bad checksum when
+        voting...) so it can take it instead."""
+        decoder = self.decoder()
+        directory = self.directory(track)
+        indexed = directory.index_address_prologues(decoder.address_prologues)
+        if not indexed or not directory.data_starts or track.cycle_index() is None: return None
+        length, starts = indexed
+        mark = track.mark()
+        sectors = OrderedDict()
+        buffer = SectorBuffer(self.sectors_per_track)
+        starting_revolutions = track.revolutions
+        verified_sectors = []
+        messages = []
+        while (len(verified_sectors) < self.sectors_per_track) and \
+              (track.revolutions < starting_revolutions + 2):
+            start_bit_index = track.bit_index
+            if not track.find_cycle(starts, length): break
+            if (track.bit_index - start_bit_index) % track.bit_count > 256:
+                start_bit_index = (track.bit_index - 256) % track.bit_count
+            address_field = directory.address_field_at_point(track)
+            if address_field.sector_num in verified_sectors or \
+               address_field.sector_num > self.sectors_per_track or \
+               not decoder.address_epilogue_at_point(track) or \
+               not directory.find_data_prologue(track):
+                break
+            data_field = directory.data_field_at_point(track)
+            if not data_field or not decoder.data_epilogue_at_point(track) or \
+               (vote and not data_field.checksum_valid):
+                break
+            messages.append("found sector %s" % hex(address_field.sector_num)[2:].upper())
+            sectors[address_field.sector_num] = None
+            if burn:
+                burn -= 1
+                continue
+            sectors[address_field.sector_num] = Sector(address_field, data_field, start_bit_index, track.bit_index, buffer, len(verified_sectors))
+            verified_sectors.append(address_field.sector_num)
+            messages.append("saved sector %s" % hex(address_field.sector_num))
+        if len(verified_sectors) < self.sectors_per_track or None in sectors.values():
+            track.restore(mark)
+            return None
+        for message in messages:
+            self.g.logger.debug(message)
+        return sectors
+
+    def vote_sectors(self, track, logical_track_num, verified_sectors, buffer=None):
+        """returns dict of a Sector for each sector on |track| that isn't in
+        |verified_sectors|, made from every copy of it in the whole
+        bitstream (every revolution the track holds, like an .a2r track
+        after reseek()) by voting on each nibble of its data field (see
+        vote_nibbles()). A sector is only returned if it has more than one
+        copy and the voted nibbles decode with the right checksum. Sectors
+        that aren't read with RWTS's own data_field_at_point() (or have a
+        fake_data_field quirk) aren't voted on. The sectors are decoded into
+        |buffer| (a SectorBuffer), after the slots of |verified_sectors|, if
+        there is one. Leaves the track where it was."""
+        if type(self).data_field_at_point is not RWTS.data_field_at_point: return {}
+        mark = track.mark()
+        track.restore((0, 0))
+        copies = OrderedDict()
+        while track.revolutions < 1:
+            start_bit_index = track.bit_index
+            if not self.find_address_prologue(track) or track.revolutions >= 1: break
+            if (track.bit_index - start_bit_index) % track.bit_count > 256:
+                start_bit_index = (track.bit_index - 256) % track.bit_count
+            address_field = self.address_field_at_point(track)
+            sector_num = address_field.sector_num
+            if sector_num in verified_sectors or sector_num > self.sectors_per_track or \
+               self.quirk(logical_track_num, sector_num).fake_data_field or \
+               not self.verify_address_epilogue_at_point(track, logical_track_num, sector_num):
+                continue
+            if not self.find_data_prologue(track, logical_track_num, sector_num): break
+            nibbles = track.read_nibbles(self.encoding.field_length)
+            copies.setdefault(sector_num, []).append((address_field, nibbles, start_bit_index, track.bit_index))
+        track.restore(mark)
+        translate_table = self.decoder().translate_table
+        sectors = {}
+        for sector_num, found in copies.items():
+            if len(found) < 2: continue
+            data_field = check_data_fields([vote_nibbles([nibbles for address_field, nibbles, start_bit_index, end_bit_index in found], translate_table)], translate_table, self.encoding)[0]
+            if not data_field or not data_field.checksum_valid: continue
+            address_field, nibbles, start_bit_index, end_bit_index = found[0]
+            sectors[sector_num] = Sector(address_field, data_field, start_bit_index, end_bit_index, buffer, len(verified_sectors) + len(sectors))
+            self.g.logger.debug("voted sector %s from %d copies" % (hex(sector_num), len(found)))
+        return sectors
 
-    def decode_track(self, track, logical_track_num, burn=0):
+    def decode_track(self, track, logical_track_num, burn=0, vote=False):
         sectors = OrderedDict()
         if not track: return sectors
         if not track.bits: return sectors
+        if self.reads_standard_sectors():
+            standard_sectors = self.decode_standard_track(track, logical_track_num, burn, vote)
+            if standard_sectors is not None: return standard_sectors
+        # no guessing where the next sector should be from earlier tracks:
+        # on a track that's in step, the SectorDirectory already knows
+        # exactly where every address field is, so each search below is a
+        # lookup. And the 2-revolution limit can't be cut short, because
+        # where this stops is where the next RWTS in run() starts reading,
+        # which decides the order of the sectors it finds (and so the
+        # track Convert writes).
+        # the sectors saved from here on are decoded into one buffer
+        buffer = SectorBuffer(self.sectors_per_track)
         starting_revolutions = track.revolutions
         verified_sectors = []
         while (len(verified_sectors) < self.sectors_per_track) and \
@@ -139,9 +378,10 @@ class RWTS:
                 self.g.logger.debug("can't find a single address prologue so LGTM or whatever")
                 break
             # for .woz conversion, only save some of the bits preceding
-            # the address prologue
-            if track.bit_index - start_bit_index > 256:
-                start_bit_index = track.bit_index - 256
+            # the address prologue (measured around the splice point, if
+            # the search wrapped)
+            if (track.bit_index - start_bit_index) % track.bit_count > 256:
+                start_bit_index = (track.bit_index - 256) % track.bit_count
             # decode address field
             address_field = self.address_field_at_point(track)
             self.g.logger.debug("found sector %s" % hex(address_field.sector_num)[2:].upper())
@@ -169,9 +409,9 @@ class RWTS:
                 # if we can't find a data field prologue, just give up
                 self.g.logger.debug("find_data_prologue failed, giving up")
                 break
-            # read and decode the data field, and verify the data checksum
-            decoded = self.data_field_at_point(track, logical_track_num, address_field.sector_num)
-            if not decoded:
+            # read the data field (the Sector decodes it when it's needed)
+            data_field = self.data_field_at_point(track, logical_track_num, address_field.sector_num)
+            if not data_field:
                 # decoding data field failed, but this is not necessarily fatal
                 # because there might be another copy of this sector later
                 self.g.logger.debug("data_field_at_point failed, continuing")
@@ -189,10 +429,19 @@ class RWTS:
             if burn:
                 burn -= 1
                 continue
+            if vote and isinstance(data_field, DataField) and not data_field.checksum_valid:
+                # when voting, a data field with a bad checksum only keeps its
+                # placeholder, so a later copy or the vote below can replace it
+                self.g.logger.debug("bad data field checksum, continuing")
+                continue
             # all good, and we want to save this sector, so do it
-            sectors[address_field.sector_num] = Sector(address_field, decoded, start_bit_index, end_bit_index)
+            sectors[address_field.sector_num] = Sector(address_field, data_field, start_bit_index, end_bit_index, buffer, len(verified_sectors))
             verified_sectors.append(address_field.sector_num)
             self.g.logger.debug("saved sector %s" % hex(address_field.sector_num))
+        # if the caller asked for it, vote on the sectors we still don't have
+        # (taking the place of their placeholders, if they have one)
+        if vote and len(verified_sectors) < self.sectors_per_track:
+            sectors.update(self.vote_sectors(track, logical_track_num, verified_sectors, buffer))
         # remove placeholders of sectors that we found but couldn't decode properly
         # (made slightly more difficult by the fact that we're trying to remove
         # elements from an OrderedDict while iterating through the OrderedDict,
@@ -207,8 +456,11 @@ class RWTS:
     def enough(self, logical_track_num, physical_sectors):
         return len(physical_sectors) == self.sectors_per_track
 
+from .directory import *
+from .trackstats import *
 from .universal import *
 from .dos33 import *
+from .dos32 import *
 from .sunburst import *
 from .border import *
 from .d5timing import *
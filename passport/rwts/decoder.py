@@ -0,0 +1,424 @@
+from collections import OrderedDict
+import functools
+
+# marks a disk nibble that isn't in the translate table (or translates to a
+# value the RWTS would reject), in a compiled translate table
+kInvalidNibble = 0xFF
+
+# 6-and-2 encoding stores the low 2 bits of each byte swapped, 3 pairs per
+# auxiliary nibble, so these pick out and unswap each pair
+kLowBits = [bytes([((v & 0b01) << 1) + ((v & 0b10) >> 1) for v in [(c >> shift) & 0b11 for c in range(256)]])
+            for shift in (0, 2, 4)]
+# upper 6 bits of each byte, for running checksums that fit in 6 bits
+kHighBits = bytes([(c << 2) & 0xFF for c in range(256)])
+# high bit of each of the 342 nibble values, set for invalid nibbles
+kInvalidMask = int.from_bytes(b"\x80" * 342, "big")
+# top 2 bits of the last 256 running checksums, which become the upper 6 bits
+# of each decoded byte
+kOverflowMask = int.from_bytes(b"\xC0" * 256, "big")
+
+# 5-and-3 encoding (13-sector disks) stores the upper 5 bits of each byte as a
+# nibble of its own, and the low 3 bits of each group of 5 bytes as 3 nibbles:
+# 3 bytes' worth in their upper 3 bits, and the other 2 bytes' worth spread
+# across their lowest 2 bits
+k53High = bytes([(c << 3) & 0xFF for c in range(256)])
+# the bits of each low nibble that go in each byte of a group, one column
+# (51 groups) of them
+k53Low = b"\x07" * 51
+k53Bit0 = b"\x01" * 51
+k53Bit1 = b"\x02" * 51
+
+def compile_translate_table(nibble_translate_table):
+    """returns 256-byte bytes object mapping each disk nibble to its 6-bit
+    value, or to kInvalidNibble for nibbles that aren't in
+    |nibble_translate_table| (a dict) or translate to 0x80 or more"""
+    table = bytearray([kInvalidNibble]) * 256
+    for n, b in nibble_translate_table.items():
+        if 0 <= n < 256 and b < 0x80:
+            table[n] = b
+    return bytes(table)
+
+def decode62(disk_nibbles, translate_table):
+    """returns bytearray of the 256 bytes encoded in the first 342 6-and-2
+    nibbles of |disk_nibbles| (bytes), using |translate_table| from
+    compile_translate_table(), or None if any of those nibbles is invalid
+
+    The checksum nibble isn't checked, to match what the original per-nibble
+    decoder accepted. Running checksums that don't fit in 6 bits would
+    decode to bytes over 0xFF, so those data fields are rejected too."""
+    values = disk_nibbles[:342].translate(translate_table)
+    if len(values) < 342: return None
+    running = int.from_bytes(values, "big")
+    if running & kInvalidMask: return None
+    # each nibble is XORed with all the ones before it; treating the nibbles
+    # as one big-endian integer, that's a prefix XOR done by doubling shifts
+    for shift in (8, 16, 32, 64, 128, 256, 512, 1024, 2048):
+        running ^= running >> shift
+    if running & kOverflowMask: return None
+    checksums = running.to_bytes(342, "big")
+    auxiliary = checksums[:86]
+    high = checksums[86:].translate(kHighBits)
+    low = auxiliary.translate(kLowBits[0]) + auxiliary.translate(kLowBits[1]) + auxiliary[:84].translate(kLowBits[2])
+    return bytearray((int.from_bytes(high, "big") | int.from_bytes(low, "big")).to_bytes(256, "big"))
+
+def verify62(disk_nibbles, translate_table):
+    """returns True if the 343rd 6-and-2 nibble of |disk_nibbles| (bytes) is
+    the right checksum for the 342 before it, using |translate_table| from
+    compile_translate_table(), without decoding anything"""
+    values = disk_nibbles[:343].translate(translate_table)
+    if len(values) < 343: return False
+    running = int.from_bytes(values, "big")
+    if running & (kInvalidMask << 8 | 0x80): return False
+    # XOR of every nibble folds into the last byte
+    for shift in (8, 16, 32, 64, 128, 256, 512, 1024, 2048):
+        running ^= running >> shift
+    return running & 0xFF == 0
+
+@functools.lru_cache(maxsize=8)
+def prefix_masks(count, length):
+    """returns list of (shift, mask) for the prefix XOR of |count| fields of
+    |length| nibbles back to back as one big-endian integer, pairing each
+    shift with the bytes it may land on, so it never carries from one field
+    into the next"""
+    masks = []
+    shift = 1
+    while shift < length:
+        field = b"\x00" * shift + b"\xFF" * (length - shift)
+        masks.append((8 * shift, int.from_bytes(field * count, "big")))
+        shift *= 2
+    return masks
+
+@functools.lru_cache(maxsize=4)
+def field_masks(count):
+    """returns (prefix_masks, overflow_mask) for |count| 343-nibble data
+    fields back to back as one big-endian integer (see prefix_masks()), where
+    overflow_mask covers the top 2 bits of the running checksums that become
+    the upper 6 bits of each decoded byte"""
+    field = b"\x00" * 86 + b"\xC0" * 256 + b"\x00"
+    return prefix_masks(count, 343), int.from_bytes(field * count, "big")
+
+def _check62_many(fields, translate_table):
+    """returns (checksums, results) for |fields| (bytes objects of 343 disk
+    nibbles) laid end to end, where |checksums| is the running checksum
+    after each nibble and |results| is a list of (decodable, checksum_valid)
+    for each field"""
+    count = len(fields)
+    values = b"".join([field[:343].ljust(343, b"\x00") for field in fields]).translate(translate_table)
+    prefix_masks, overflow_mask = field_masks(count)
+    running = int.from_bytes(values, "big")
+    for shift, mask in prefix_masks:
+        running ^= (running >> shift) & mask
+    checksums = running.to_bytes(343 * count, "big")
+    overflows = (running & overflow_mask).to_bytes(343 * count, "big")
+    results = []
+    for k, field in enumerate(fields):
+        a = 343 * k
+        if len(field) < 343 or values.find(b"\xff", a, a + 342) != -1:
+            results.append((False, False))
+        else:
+            results.append((overflows.count(0, a, a + 343) == 343, values[a + 342] != 0xFF and checksums[a + 342] == 0))
+    return checksums, results
+
+def check62_many(fields, translate_table):
+    """returns list of (decodable, checksum_valid) for each of |fields| (bytes
+    objects of 343 disk nibbles), checked together in one pass without
+    decoding anything. |decodable| is whether decode62() would decode the
+    field, and |checksum_valid| is what verify62() would return."""
+    if not fields: return []
+    return _check62_many(fields, translate_table)[1]
+
+def decode62_many(fields, translate_table):
+    """returns list of (decoded, checksum_valid) for each of |fields| (bytes
+    objects of 343 disk nibbles), decoded together in one pass. |decoded| is
+    what decode62() would return for the field, and |checksum_valid| is
+    what verify62() would."""
+    if not fields: return []
+    checksums, results = _check62_many(fields, translate_table)
+    high = checksums.translate(kHighBits)
+    highs = []
+    lows = []
+    for k, (decodable, checksum_valid) in enumerate(results):
+        if decodable:
+            a = 343 * k
+            auxiliary = checksums[a:a + 86]
+            highs.append(high[a + 86:a + 342])
+            lows.append(auxiliary.translate(kLowBits[0]) + auxiliary.translate(kLowBits[1]) + auxiliary[:84].translate(kLowBits[2]))
+    # and then all the decoded bytes at once
+    if highs:
+        data = (int.from_bytes(b"".join(highs), "big") | int.from_bytes(b"".join(lows), "big")).to_bytes(256 * len(highs), "big")
+    decoded = []
+    k = 0
+    for decodable, checksum_valid in results:
+        if decodable:
+            decoded.append((bytearray(data[256 * k:256 * (k + 1)]), checksum_valid))
+            k += 1
+        else:
+            decoded.append((None, checksum_valid))
+    return decoded
+
+@functools.lru_cache(maxsize=4)
+def field_masks53(count):
+    """returns (prefix_masks, overflow_mask) for |count| 411-nibble data
+    fields back to back as one big-endian integer (see prefix_masks()), where
+    overflow_mask covers the bits of the running checksums that don't fit in
+    the 5 bits each nibble holds"""
+    field = b"\xE0" * 410 + b"\x00"
+    return prefix_masks(count, 411), int.from_bytes(field * count, "big")
+
+def _check53_many(fields, translate_table):
+    """returns (checksums, results) for |fields| (bytes objects of 411 disk
+    nibbles) laid end to end, like _check62_many()"""
+    count = len(fields)
+    values = b"".join([field[:411].ljust(411, b"\x00") for field in fields]).translate(translate_table)
+    prefix_masks, overflow_mask = field_masks53(count)
+    running = int.from_bytes(values, "big")
+    for shift, mask in prefix_masks:
+        running ^= (running >> shift) & mask
+    checksums = running.to_bytes(411 * count, "big")
+    overflows = (running & overflow_mask).to_bytes(411 * count, "big")
+    results = []
+    for k, field in enumerate(fields):
+        a = 411 * k
+        if len(field) < 411 or values.find(b"\xff", a, a + 410) != -1:
+            results.append((False, False))
+        else:
+            results.append((overflows.count(0, a, a + 411) == 411, values[a + 410] != 0xFF and checksums[a + 410] == 0))
+    return checksums, results
+
+def check53_many(fields, translate_table):
+    """returns list of (decodable, checksum_valid) for each of |fields| (bytes
+    objects of 411 5-and-3 disk nibbles), checked together in one pass
+    without decoding anything"""
+    if not fields: return []
+    return _check53_many(fields, translate_table)[1]
+
+def decode53_many(fields, translate_table):
+    """returns list of (decoded, checksum_valid) for each of |fields| (bytes
+    objects of 411 5-and-3 disk nibbles), decoded together in one pass.
+    |decoded| is a bytearray of the 256 bytes, or None if any of the first
+    410 nibbles is invalid, and |checksum_valid| is whether the 411th one is
+    the right checksum for them.
+
+    The first 154 nibbles hold the low 3 bits, last one first, and the next
+    256 the upper 5 bits. Decoded bytes come out in groups of 5, one from
+    each fifth of those 256 (again last one first), so each group is one
+    byte from each of 5 columns, which are built for every field at once."""
+    if not fields: return []
+    checksums, results = _check53_many(fields, translate_table)
+    high = checksums.translate(k53High)
+    columns = [[] for m in range(5)]
+    lows = [[] for m in range(3)]
+    last = []
+    for k, (decodable, checksum_valid) in enumerate(results):
+        if decodable:
+            a = 411 * k
+            for m in range(5):
+                columns[m].append(high[a + 204 + 51 * m:a + 153 + 51 * m:-1])
+            lows[0].append(checksums[a + 103:a + 154])
+            lows[1].append(checksums[a + 52:a + 103])
+            lows[2].append(checksums[a + 1:a + 52])
+            last.append(high[a + 409] | (checksums[a] & 0x07))
+    decoded = []
+    if last:
+        count = len(last)
+        low_mask = int.from_bytes(k53Low * count, "big")
+        bit0 = int.from_bytes(k53Bit0 * count, "big")
+        bit1 = int.from_bytes(k53Bit1 * count, "big")
+        t1, t2, t3 = [int.from_bytes(b"".join(low), "big") for low in lows]
+        highs = [int.from_bytes(b"".join(column), "big") for column in columns]
+        columns = [(highs[0] | ((t1 >> 2) & low_mask)).to_bytes(51 * count, "big"),
+                   (highs[1] | ((t2 >> 2) & low_mask)).to_bytes(51 * count, "big"),
+                   (highs[2] | ((t3 >> 2) & low_mask)).to_bytes(51 * count, "big"),
+                   (highs[3] | ((t1 & bit1) << 1) | (t2 & bit1) | ((t3 & bit1) >> 1)).to_bytes(51 * count, "big"),
+                   (highs[4] | ((t1 & bit0) << 2) | ((t2 & bit0) << 1) | (t3 & bit0)).to_bytes(51 * count, "big")]
+        # and then interleave the columns into each field's bytes
+        for k in range(count):
+            data = bytearray(256)
+            for m in range(5):
+                data[m:255:5] = columns[m][51 * k:51 * (k + 1)]
+            data[255] = last[k]
+            decoded.append(data)
+    decoded = iter(decoded)
+    return [(decodable and next(decoded) or None, checksum_valid) for decodable, checksum_valid in results]
+
+def decode53(disk_nibbles, translate_table):
+    """returns bytearray of the 256 bytes encoded in the first 410 5-and-3
+    nibbles of |disk_nibbles| (bytes), using |translate_table| from
+    compile_translate_table(), or None if any of those nibbles is invalid"""
+    if len(disk_nibbles) < 410: return None
+    return decode53_many([disk_nibbles[:410] + b"\x00"], translate_table)[0][0]
+
+def verify53(disk_nibbles, translate_table):
+    """returns True if the 411th 5-and-3 nibble of |disk_nibbles| (bytes) is
+    the right checksum for the 410 before it"""
+    return check53_many([disk_nibbles[:411]], translate_table)[0][1]
+
+class Encoding:
+    """how a data field is encoded on disk: |field_length| disk nibbles
+    (checksum included), and the functions that decode and verify one or
+    check and decode a batch of them"""
+    __slots__ = ("name", "field_length", "decode", "verify", "check_many", "decode_many")
+
+    def __init__(self, name, field_length, decode, verify, check_many, decode_many):
+        self.name = name
+        self.field_length = field_length
+        self.decode = decode
+        self.verify = verify
+        self.check_many = check_many
+        self.decode_many = decode_many
+
+kEncoding62 = Encoding("6-and-2", 343, decode62, verify62, check62_many, decode62_many)
+kEncoding53 = Encoding("5-and-3", 411, decode53, verify53, check53_many, decode53_many)
+
+def vote_nibbles(copies, translate_table):
+    """returns bytes object of the nibbles most of |copies| (bytes objects of
+    the same length, all read from the same field) agree on, one position
+    at a time, using |translate_table| from compile_translate_table(). A
+    nibble that isn't valid only wins if no copy has a valid one there, and
+    a tie goes to the earliest copy."""
+    voted = bytearray(copies[0])
+    for i, column in enumerate(zip(*copies)):
+        if column.count(column[0]) == len(column): continue
+        voted[i] = max(column, key=lambda n: (translate_table[n] != kInvalidNibble, column.count(n)))
+    return bytes(voted)
+
+class DecodeMemo:
+    """bounded memo of what data fields decode to, keyed by their raw
+    nibbles and compiled translate table, so sectors that turn up again and
+    again (all zeroes, all $FF, formatted but never written) on a disk, or
+    across a batch of disks, are only checked and decoded once. Holds at
+    most |size| of them, dropping the least recently used first, and a
+    |size| of 0 turns it off. |hits| and |misses| count lookups, for
+    tuning |size|."""
+    __slots__ = ("size", "entries", "hits", "misses")
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, nibbles, translate_table):
+        """returns (decoded, checksum_valid) for |nibbles| (bytes) and
+        |translate_table|, where |decoded| is None if they don't decode, or
+        None if they aren't memoized"""
+        if not self.size: return None
+        key = (nibbles, translate_table)
+        found = self.entries.get(key)
+        if found is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return found
+
+    def put(self, nibbles, translate_table, decoded, checksum_valid):
+        """memoizes |decoded| (bytes, or None) and |checksum_valid| for
+        |nibbles| (bytes) and |translate_table|"""
+        if not self.size: return
+        key = (nibbles, translate_table)
+        self.entries[key] = (decoded, checksum_valid)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def resize(self, size):
+        """changes |size|, dropping the least recently used entries that
+        don't fit"""
+        self.size = size
+        while len(self.entries) > size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        """returns fraction of lookups that were hits (0.0 if none yet)"""
+        lookups = self.hits + self.misses
+        return lookups and self.hits / lookups or 0.0
+
+# shared by every RWTS and every disk, so a batch of disks shares it too
+decode_memo = DecodeMemo()
+
+class DataField:
+    """a data field that has been checked (see check62_many()) and can be
+    decoded, but hasn't been yet. decode() decodes it along with the rest of
+    |batch| (the fields checked with it, usually the rest of the track),
+    since whatever needs one of them usually needs them all. |encoding| is
+    how it's encoded (an Encoding)."""
+    __slots__ = ("nibbles", "translate_table", "checksum_valid", "batch", "decoded", "encoding")
+
+    def __init__(self, nibbles, translate_table, checksum_valid, batch=None, decoded=None, encoding=kEncoding62):
+        self.nibbles = nibbles
+        self.translate_table = translate_table
+        self.checksum_valid = checksum_valid
+        self.batch = batch or [self]
+        self.decoded = decoded
+        self.encoding = encoding
+
+    def decode(self):
+        """returns bytes object of the 256 decoded bytes"""
+        if self.decoded is None:
+            pending = [field for field in self.batch if field.decoded is None]
+            results = self.encoding.decode_many([field.nibbles for field in pending], self.translate_table)
+            for field, (decoded, checksum_valid) in zip(pending, results):
+                field.decoded = bytes(decoded)
+                field.batch = None
+                decode_memo.put(field.nibbles, field.translate_table, field.decoded, field.checksum_valid)
+        return self.decoded
+
+def check_data_fields(fields, translate_table, encoding=kEncoding62):
+    """returns list of a DataField (or None, if it can't be decoded) for each
+    of |fields| (bytes objects of |encoding|.field_length disk nibbles). The
+    ones that aren't in decode_memo are checked together, as one batch."""
+    data_fields = [None] * len(fields)
+    unknown = []
+    for k, field in enumerate(fields):
+        found = decode_memo.get(field, translate_table)
+        if found is None:
+            unknown.append(k)
+        elif found[0] is not None:
+            data_fields[k] = DataField(field, translate_table, found[1], decoded=found[0], encoding=encoding)
+    batch = []
+    for k, (decodable, checksum_valid) in zip(unknown, encoding.check_many([fields[k] for k in unknown], translate_table)):
+        if decodable:
+            batch.append(DataField(fields[k], translate_table, checksum_valid, batch, encoding=encoding))
+            data_fields[k] = batch[-1]
+        else:
+            decode_memo.put(fields[k], translate_table, None, checksum_valid)
+    return data_fields
+
+class Decoder:
+    """one set of RWTS parameters, prebuilt for finding and decoding sectors
+    (see compile_decoder())"""
+    __slots__ = ("address_prologues", "address_epilogue", "data_prologue",
+                 "data_epilogue", "translate_table", "encoding", "directory_key")
+
+    def __init__(self, address_prologues, address_epilogue, data_prologue, data_epilogue, translate_table, encoding=kEncoding62):
+        self.address_prologues = tuple([bytes(p) for p in address_prologues])
+        self.address_epilogue = bytes(address_epilogue)
+        self.data_prologue = bytes(data_prologue)
+        self.data_epilogue = bytes(data_epilogue)
+        self.translate_table = translate_table
+        self.encoding = encoding
+        # what a SectorDirectory depends on, so RWTSes that only differ in
+        # their address prologues or epilogues share one
+        self.directory_key = (self.data_prologue, self.translate_table, self.encoding)
+
+    def address_epilogue_at_point(self, track):
+        return track.read_nibbles(len(self.address_epilogue)) == self.address_epilogue
+
+    def data_epilogue_at_point(self, track):
+        return track.read_nibbles(len(self.data_epilogue)) == self.data_epilogue
+
+    def decode(self, disk_nibbles):
+        return self.encoding.decode(disk_nibbles, self.translate_table)
+
+    def verify(self, disk_nibbles):
+        return self.encoding.verify(disk_nibbles, self.translate_table)
+
+@functools.lru_cache(maxsize=64)
+def compile_decoder(address_prologues, address_epilogue, data_prologue, data_epilogue, translate_table, encoding=kEncoding62):
+    """returns Decoder for |address_prologues| (tuple of tuples of nibbles),
+    the other prologues and epilogues (tuples of nibbles), |translate_table|
+    from compile_translate_table() and |encoding|. The most recently used
+    ones are kept, so disks that share parameters (or an RWTS that switches
+    between a few sets of them, like SunburstRWTS) don't rebuild them."""
+    return Decoder(address_prologues, address_epilogue, data_prologue, data_epilogue, translate_table, encoding)
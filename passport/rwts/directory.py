@@ -0,0 +1,157 @@
+import bisect
+from passport.rwts import AddressField
+from passport.rwts.decoder import check_data_fields, kEncoding62
+from passport.util import *
+
+def find_all(haystack, sequence, stop):
+    """returns list of every index below |stop| where |sequence| starts in
+    |haystack|, including overlapping ones"""
+    starts = []
+    i = haystack.find(sequence)
+    while 0 <= i < stop:
+        starts.append(i)
+        i = haystack.find(sequence, i + 1)
+    return starts
+
+class DirectoryEntry:
+    """one address field on a track, and the data field that follows it"""
+    __slots__ = ("index", "address_bit_index", "address_field", "address_epilogue",
+                 "data_index", "data_bit_index", "data_field", "data_epilogue")
+
+    def __init__(self, index, address_bit_index, address_field, address_epilogue,
+                 data_index=None, data_bit_index=None, data_field=None, data_epilogue=b""):
+        self.index = index
+        self.address_bit_index = address_bit_index
+        self.address_field = address_field
+        self.address_epilogue = address_epilogue
+        self.data_index = data_index
+        self.data_bit_index = data_bit_index
+        self.data_field = data_field
+        self.data_epilogue = data_epilogue
+
+class SectorDirectory:
+    """every address field on a track, and the data field after each one,
+    for one data prologue, nibble translate table and encoding, found from the
+    nibbles of one revolution (Track.cycle()) so the bitstream is only
+    traversed once.
+
+    Each entry records where the address field is, what it says, the
+    nibbles after it (where the epilogue should be), where the next data
+    field is, whether it can be decoded and its checksum is right (a
+    DataField, which isn't decoded until a sector's bytes are needed), and
+    the nibbles after it. The RWTS hooks read from here instead of scanning and
+    decoding the track again.
+
+    Address prologues aren't part of what a directory is for. Each set of
+    them is indexed the first time an RWTS looks for it, and entries are
+    shared by every set that finds them. The disk's own RWTS and the
+    built-in ones that BasePassportProcessor.run() falls back to on the
+    same track (UniversalRWTS, UniversalRWTSIgnoreEpilogues) use the same
+    prologues for data fields, so between them they check each data field
+    once, and each fallback is lookups into what the ones before it found.
+    Anything the directory can't answer exactly (reads that are out of step
+    with the cycle, or prologues it can't index) falls back to reading the
+    track."""
+
+    def __init__(self, track, data_prologue, translate_table, encoding=kEncoding62):
+        self.track = track
+        self.data_prologue = bytes(data_prologue)
+        self.translate_table = translate_table
+        self.encoding = encoding
+        self.field_length = encoding.field_length
+        self.entries = {}
+        self.data_fields = {}
+        self.address_starts = {}
+        self.data_starts = None
+        self.cycle = track.cycle()
+        if not self.cycle: return
+        # enough laps of the cycle to read a whole sector from anywhere in it
+        self.text = self.cycle * (2 + (self.field_length + 57) // len(self.cycle))
+        if self.data_prologue:
+            self.data_starts = find_all(self.text, self.data_prologue, len(self.cycle))
+
+    def index_address_prologues(self, address_prologues):
+        """returns (length, starts) for |address_prologues| (tuple of bytes
+        objects, all the same length), where |starts| is the sorted cycle
+        indexes where any of them start, adding an entry for each one the
+        first time. Returns None if they can't be indexed."""
+        if address_prologues not in self.address_starts:
+            indexed = None
+            if self.cycle and address_prologues and len(set([len(p) for p in address_prologues])) == 1 and address_prologues[0]:
+                length = len(address_prologues[0])
+                starts = sorted(set(sum([find_all(self.text, p, len(self.cycle)) for p in address_prologues], [])))
+                self.add_entries([((start + length) % len(self.cycle), self.track.cycle_bit_index(start)) for start in starts])
+                indexed = (length, starts)
+            self.address_starts[address_prologues] = indexed
+        return self.address_starts[address_prologues]
+
+    def entry(self, index, address_bit_index=None):
+        """returns DirectoryEntry for an address field starting at cycle
+        index |index|, building it the first time"""
+        if index not in self.entries:
+            self.add_entries([(index, address_bit_index)])
+        return self.entries[index]
+
+    def add_entries(self, places):
+        """adds an entry for the address field at each (index,
+        address_bit_index) in |places| that doesn't have one yet, checking
+        all of their data fields together"""
+        text = self.text
+        entries = []
+        for index, address_bit_index in places:
+            if index in self.entries: continue
+            nibbles = text[index:index + 8]
+            entry = DirectoryEntry(index,
+                                   address_bit_index,
+                                   AddressField(decode44(nibbles[0], nibbles[1]),
+                                                decode44(nibbles[2], nibbles[3]),
+                                                decode44(nibbles[4], nibbles[5]),
+                                                decode44(nibbles[6], nibbles[7])),
+                                   text[index + 8:index + 11])
+            self.entries[index] = entry
+            if not self.data_starts: continue
+            # first data prologue after the address field
+            k = bisect.bisect_left(self.data_starts, (index + 8) % len(self.cycle))
+            data_start = self.data_starts[k % len(self.data_starts)]
+            entry.data_bit_index = self.track.cycle_bit_index(data_start)
+            entry.data_index = (data_start + len(self.data_prologue)) % len(self.cycle)
+            entry.data_epilogue = text[entry.data_index + self.field_length:entry.data_index + self.field_length + 3]
+            entries.append(entry)
+        data_indexes = sorted(set([entry.data_index for entry in entries if entry.data_index not in self.data_fields]))
+        data_fields = check_data_fields([text[i:i + self.field_length] for i in data_indexes], self.translate_table, self.encoding)
+        self.data_fields.update(zip(data_indexes, data_fields))
+        for entry in entries:
+            entry.data_field = self.data_fields[entry.data_index]
+
+    def find_address_prologue(self, track, address_prologues):
+        """like RWTS.find_address_prologue() for |address_prologues| (tuple of
+        bytes objects), or None if the directory can't tell"""
+        indexed = self.index_address_prologues(address_prologues)
+        if not indexed: return None
+        length, starts = indexed
+        return track.find_cycle(starts, length)
+
+    def address_field_at_point(self, track):
+        """like RWTS.address_field_at_point(), or None if the directory can't tell
+        (adding an entry for the address field if it isn't one already)"""
+        i = track.cycle_index()
+        if i is None: return None
+        entry = self.entry(i % len(self.cycle))
+        track.seek_cycle_index(i + 8)
+        return entry.address_field
+
+    def find_data_prologue(self, track):
+        """like RWTS.find_data_prologue(), or None if the directory can't tell"""
+        if self.data_starts is None: return None
+        return track.find_cycle(self.data_starts, len(self.data_prologue))
+
+    def data_field_at_point(self, track):
+        """like RWTS.data_field_at_point(), reading the track if the directory
+        can't tell"""
+        i = track.cycle_index()
+        if i is None:
+            return check_data_fields([track.read_nibbles(self.field_length)], self.translate_table, self.encoding)[0]
+        if i % len(self.cycle) not in self.data_fields:
+            self.data_fields[i % len(self.cycle)] = check_data_fields([self.text[i % len(self.cycle):i % len(self.cycle) + self.field_length]], self.translate_table, self.encoding)[0]
+        track.seek_cycle_index(i + self.field_length)
+        return self.data_fields[i % len(self.cycle)]
@@ -0,0 +1,45 @@
+from passport.rwts import RWTS
+from passport.rwts.universal import UniversalRWTS, UniversalRWTSIgnoreEpilogues
+from passport.rwts.decoder import kEncoding53
+
+class DOS32RWTS(RWTS):
+    """13-sector disks (DOS 3.2 and earlier), whose data fields are 5-and-3
+    encoded. Every sector is read with RWTS's own hooks, so whole tracks are
+    read and decoded in bulk from their SectorDirectory (see
+    RWTS.decode_standard_track())."""
+    kDefaultSectorOrder13 =     tuple(range(13))
+    kDefaultAddressPrologue13 = (0xD5, 0xAA, 0xB5)
+    kDefaultNibbleTranslationTable13 = {
+        0xab: 0x00, 0xad: 0x01, 0xae: 0x02, 0xaf: 0x03, 0xb5: 0x04, 0xb6: 0x05, 0xb7: 0x06, 0xba: 0x07,
+        0xbb: 0x08, 0xbd: 0x09, 0xbe: 0x0a, 0xbf: 0x0b, 0xd6: 0x0c, 0xd7: 0x0d, 0xda: 0x0e, 0xdb: 0x0f,
+        0xdd: 0x10, 0xde: 0x11, 0xdf: 0x12, 0xea: 0x13, 0xeb: 0x14, 0xed: 0x15, 0xee: 0x16, 0xef: 0x17,
+        0xf5: 0x18, 0xf6: 0x19, 0xf7: 0x1a, 0xfa: 0x1b, 0xfb: 0x1c, 0xfd: 0x1d, 0xfe: 0x1e, 0xff: 0x1f,
+    }
+
+    encoding = kEncoding53
+
+    def __init__(self, g):
+        RWTS.__init__(self,
+                      g,
+                      sectors_per_track=13,
+                      address_prologue=self.kDefaultAddressPrologue13,
+                      sector_order=self.kDefaultSectorOrder13,
+                      nibble_translate_table=self.kDefaultNibbleTranslationTable13)
+
+class UniversalDOS32RWTS(UniversalRWTS):
+    """UniversalRWTS for 13-sector disks, which BasePassportProcessor.run()
+    falls back to instead when DOS32RWTS can't read a track"""
+    acceptable_address_prologues = ((0xD4,0xAA,0xB5), (0xD5,0xAA,0xB5))
+    encoding = kEncoding53
+
+    def __init__(self, g):
+        RWTS.__init__(self,
+                      g,
+                      sectors_per_track=13,
+                      address_epilogue=[],
+                      data_epilogue=[],
+                      sector_order=DOS32RWTS.kDefaultSectorOrder13,
+                      nibble_translate_table=DOS32RWTS.kDefaultNibbleTranslationTable13)
+
+class UniversalDOS32RWTSIgnoreEpilogues(UniversalDOS32RWTS, UniversalRWTSIgnoreEpilogues):
+    pass
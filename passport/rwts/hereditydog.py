@@ -1,21 +1,22 @@
+from passport.rwts import SectorQuirk
 from passport.rwts.dos33 import DOS33RWTS
 
 class HeredityDogRWTS(DOS33RWTS):
+    quirks = (SectorQuirk(tracks=(0x00,),
+                          sectors=(0x0A,),
+                          check_data_epilogue=False),)
+
     def data_field_at_point(self, track, logical_track_num, physical_sector_num):
         if (logical_track_num, physical_sector_num) == (0x00, 0x0A):
             # This sector is fake, full of too many consecutive 0s,
-            # designed to read differently every time. We go through
-            # and clean the stray bits, and be careful not to go past
-            # the end so we don't include the next address prologue.
-            start_index = track.bit_index
-            while (track.bit_index < start_index + (343*8)):
-                if self.nibble_translate_table.get(next(track.nibble()), 0xFF) == 0xFF:
-                    track.bits[track.bit_index-8:track.bit_index] = 0
-                    self.g.found_and_cleaned_weakbits = True
+            # designed to read differently every time. We find the weak
+            # bits in the whole data field at once and clean them, and are
+            # careful not to go past the end so we don't include the next
+            # address prologue.
+            valid = set([n for n, b in self.nibble_translate_table.items() if b != 0xFF])
+            for bit_index, bit_count in track.zero_bits(track.find_weak_bits(valid, 343*8)):
+                self.g.cleaned_weakbits.append((logical_track_num, bit_index, bit_count))
+                self.g.logger.debug("cleaned %d weak bits at T%02X bit %d" % (bit_count, logical_track_num, bit_index))
+                self.g.found_and_cleaned_weakbits = True
             return bytearray(256)
         return DOS33RWTS.data_field_at_point(self, track, logical_track_num, physical_sector_num)
-
-    def verify_data_epilogue_at_point(self, track, logical_track_num, physical_sector_num):
-        if (logical_track_num, physical_sector_num) == (0x00, 0x0A):
-            return True
-        return DOS33RWTS.verify_data_epilogue_at_point(self, track, logical_track_num, physical_sector_num)
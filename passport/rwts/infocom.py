@@ -8,4 +8,4 @@ class InfocomRWTS(DOS33RWTS):
     def find_data_prologue(self, track, logical_track_num, physical_sector_num):
         if not DOS33RWTS.find_data_prologue(self, track, logical_track_num, physical_sector_num):
             return False
-        return next(track.nibble()) >= 0xAD
+        return track.read_nibbles(1)[0] >= 0xAD
@@ -0,0 +1,82 @@
+import re
+from passport.rwts.decoder import kInvalidNibble
+from passport.rwts.directory import find_all
+from passport.util import *
+
+# a drive reading a blank track latches random noise, and about half of the
+# nibbles that makes are ones a 6-and-2 translate table has no value for
+# (three quarters, for 5-and-3), where on a formatted track nearly all of
+# them are valid, so this is a safe line between the two
+kUnformattedValidRatio = 0.75
+
+class TrackStats:
+    """statistics about a whole track that don't depend on where anything
+    is reading it, for telling what kind of track it is (nibble count
+    protection, unformatted...) without decoding it. Each one is worked out
+    the first time it's asked for, from the nibbles of one revolution
+    (Track.cycle(), or what the controller reads in one revolution from bit 0
+    for a track that never falls into step), and kept. Get one with
+    track_stats() so every view of a track shares it."""
+    __slots__ = ("track", "_nibbles", "_longest_run", "_valid_ratios", "_address_fields")
+
+    def __init__(self, track):
+        self.track = track
+        self._nibbles = None
+        self._longest_run = None
+        self._valid_ratios = {}
+        self._address_fields = {}
+
+    @property
+    def nibbles(self):
+        """returns bytes object of the nibbles of one revolution"""
+        if self._nibbles is None:
+            self._nibbles = self.track.cycle()
+            if self._nibbles is None:
+                self._nibbles = self.track.view().read_nibble_span(self.track.bit_count)[0]
+        return self._nibbles
+
+    def longest_run(self):
+        """returns length of the longest run of the same nibble over and
+        over, over 2 revolutions (so a run that goes past the splice point
+        counts as one, and a track that is nothing but one nibble counts
+        twice)"""
+        if self._longest_run is None:
+            self._longest_run = max([m.end() - m.start() for m in re.finditer(rb"(.)\1*", self.nibbles * 2, re.S)] + [0])
+        return self._longest_run
+
+    def valid_ratio(self, translate_table):
+        """returns fraction of nibbles that |translate_table| (from
+        compile_translate_table()) has a value for, 0.0 if there aren't any"""
+        if translate_table not in self._valid_ratios:
+            nibbles = self.nibbles
+            invalid = nibbles.translate(translate_table).count(kInvalidNibble)
+            self._valid_ratios[translate_table] = nibbles and (len(nibbles) - invalid) / len(nibbles) or 0.0
+        return self._valid_ratios[translate_table]
+
+    def address_fields(self, address_prologues):
+        """returns list of (track_num, sector_num) from every address field
+        after any of |address_prologues| (tuple of bytes objects), in track
+        order"""
+        if address_prologues not in self._address_fields:
+            nibbles = self.nibbles
+            text = nibbles + nibbles[:16]
+            fields = []
+            for i in sorted(set(sum([[start + len(p) for start in find_all(text, p, len(nibbles))] for p in address_prologues if p], []))):
+                field = text[i:i + 6]
+                if len(field) == 6:
+                    fields.append((decode44(field[2], field[3]), decode44(field[4], field[5])))
+            self._address_fields[address_prologues] = fields
+        return self._address_fields[address_prologues]
+
+    def address_field_count(self, address_prologues):
+        """returns how many address fields there are after any of
+        |address_prologues| (tuple of bytes objects)"""
+        return len(self.address_fields(address_prologues))
+
+def track_stats(track):
+    """returns the TrackStats of |track|, building it the first time anything
+    asks (it goes when the track's bits change, see Track.invalidate())"""
+    memo = track.memo()
+    if "stats" not in memo:
+        memo["stats"] = TrackStats(track)
+    return memo["stats"]
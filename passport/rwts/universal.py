@@ -6,34 +6,26 @@ class UniversalRWTS(RWTS):
     def __init__(self, g):
         RWTS.__init__(self, g, address_epilogue=[], data_epilogue=[])
 
-    def find_address_prologue(self, track):
-        starting_revolutions = track.revolutions
-        seen = [0,0,0]
-        while (track.revolutions < starting_revolutions + 2):
-            del seen[0]
-            seen.append(next(track.nibble()))
-            if tuple(seen) in self.acceptable_address_prologues: return True
-        return False
+    def address_prologues(self):
+        return self.acceptable_address_prologues
 
     def verify_address_epilogue_at_point(self, track, logical_track_num, physical_sector_num):
 #        return True
         if not self.address_epilogue:
-            self.address_epilogue = [next(track.nibble())]
+            self.address_epilogue = [track.read_nibbles(1)[0]]
             result = True
         else:
             result = RWTS.verify_address_epilogue_at_point(self, track, logical_track_num, physical_sector_num)
-        next(track.nibble())
-        next(track.nibble())
+        track.read_nibbles(2)
         return result
 
     def verify_data_epilogue_at_point(self, track, logical_track_num, physical_sector_num):
         if not self.data_epilogue:
-            self.data_epilogue = [next(track.nibble())]
+            self.data_epilogue = [track.read_nibbles(1)[0]]
             result = True
         else:
             result = RWTS.verify_data_epilogue_at_point(self, track, logical_track_num, physical_sector_num)
-        next(track.nibble())
-        next(track.nibble())
+        track.read_nibbles(2)
         return result
 
 class UniversalRWTSIgnoreEpilogues(UniversalRWTS):
@@ -45,8 +37,7 @@ class UniversalRWTSIgnoreEpilogues(UniversalRWTS):
 
 class Track00RWTS(UniversalRWTSIgnoreEpilogues):
     def data_field_at_point(self, track, logical_track_num, physical_sector_num):
-        start_index = track.bit_index
-        start_revolutions = track.revolutions
+        start = track.mark()
         decoded = UniversalRWTS.data_field_at_point(self, track, logical_track_num, physical_sector_num)
         if not decoded:
             # If the sector didn't decode properly, rewind to the
@@ -58,6 +49,5 @@ class Track00RWTS(UniversalRWTSIgnoreEpilogues):
             # is generally logical sector 2, which is important not to
             # miss at this stage because its absence triggers a different
             # code path and everything falls apart.
-            track.bit_index = start_index
-            track.revolutions = start_revolutions
+            track.restore(start)
         return decoded
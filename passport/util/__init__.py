@@ -3,10 +3,10 @@ __all__ = ["find", "decode44", "concat_track"]
 def decode44(n1, n2):
     return ((n1 << 1) + 1) & n2
 
-def concat_track(logical_sectors):
+def concat_track(logical_sectors, sectors_per_track=16):
     """returns a single bytes object containing all data from logical_sectors dict, in order"""
     data = []
-    for i in range(16):
+    for i in range(sectors_per_track):
         if i in logical_sectors:
             data.append(logical_sectors[i].decoded)
         else:
@@ -4,13 +4,17 @@
 # MIT-licensed
 
 import argparse
+import array
 import binascii
+import bisect
 import bitarray # https://pypi.org/project/bitarray/
 import collections
+import copy
 import io
 import json
 import itertools
 import os
+import re
 import sys
 
 __version__ = "2.0-beta" # https://semver.org
@@ -32,6 +36,18 @@ kRequiresRAM = ("16K","24K","32K","48K","64K","128K","256K","512K","768K","1M","
 kRequiresMachine = ("2","2+","2e","2c","2e+","2gs","2c+","3","3+")
 kDefaultBitTiming = (0, 32, 16) # WOZ2 only
 
+# how the disk controller frames nibbles: skip 0 bits until a 1 bit, then take 8 bits
+kNibblePattern = re.compile("0*1[01]{7}")
+# self-sync nibble: FF followed by two 0 bits, so the controller falls into
+# step with a run of them from any bit phase
+kSyncNibble = bitarray.bitarray("1111111100", endian="big")
+# a run of more than two 0 bits, where a drive stops reading what's on the
+# disk and starts reading random 1 bits (weak bits)
+kWeakZeroRunPattern = re.compile("0{3,}")
+# how far a Track's cursor may move forward in all, by default, before it
+# gives up (see Track.scan_budget), in revolutions of the track
+kScanBudgetRevolutions = 32
+
 # strings and things, for print routines and error messages
 sEOF = "Unexpected EOF"
 sBadChunkSize = "Bad chunk size"
@@ -81,6 +97,7 @@ class WozMETAFormatError_BadValue(WozFormatError): pass
 class WozMETAFormatError_BadLanguage(WozFormatError): pass
 class WozMETAFormatError_BadRAM(WozFormatError): pass
 class WozMETAFormatError_BadMachine(WozFormatError): pass
+class ScanBudgetExceeded(Exception): pass # Track cursor moved further than Track.scan_budget allows
 
 def from_uint32(b):
     return int.from_bytes(b, byteorder="little")
@@ -143,47 +160,563 @@ def from_intish(v, errorClass, errorString):
 def raise_if(cond, e, s=""):
     if cond: raise e(s)
 
+def read_stream(iostream):
+    """returns writable memoryview of the rest of |iostream|, read into one
+    bytearray that every track loaded from it shares (see
+    bits_from_buffer()), so nothing keeps the file open or mapped once it
+    has been read (Convert replaces it)"""
+    try:
+        size = os.fstat(iostream.fileno()).st_size - iostream.tell()
+    except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+        return memoryview(bytearray(iostream.read()))
+    image = bytearray(max(size, 0))
+    return memoryview(image)[:iostream.readinto(image) or 0]
+
+def bits_from_buffer(buffer):
+    """returns big-endian bitarray of the bytes in |buffer|, sharing its memory
+    if this version of bitarray can import buffers (2.3+) or copying it once
+    if not"""
+    try:
+        return bitarray.bitarray(buffer=buffer, endian="big")
+    except TypeError:
+        bits = bitarray.bitarray(endian="big")
+        try:
+            bits.frombytes(buffer)
+        except TypeError:
+            # bitarray before 2.0 only takes bytes objects
+            bits.frombytes(bytes(buffer))
+        return bits
+
+class TrackCache:
+    """bitstream of a Track and everything derived from it, shared by every
+    view of the track (see Track.view())"""
+    __slots__ = ("bits", "padded_bits", "unrolled", "unrolled_bytes",
+                 "nibbles", "offsets", "nibble_at", "lap", "locks", "timing",
+                 "sync_runs", "memo")
+
+    def __init__(self, bits, bit_count):
+        # bits past |bit_count| (like the padding at the end of a .woz block)
+        # are dropped the first time Track.bits is used, so a track that
+        # shares its image's memory costs nothing until then
+        self.bits = None
+        self.padded_bits = bits
+        if len(bits) <= bit_count:
+            self.bits = bits
+
 class Track:
+    """a bitstream and a cursor into it. Every read, search and skip moves the
+    cursor through _seek_absolute(), which counts how many bits it has
+    moved forward in all (|scanned|, going back doesn't give any back) and
+    raises ScanBudgetExceeded once that passes |scan_budget| bits (see
+    start_scan_budget()). Every RWTS that reads a track shares its budget,
+    so however many of them are tried, reading one track takes a bounded
+    amount of work."""
+    __slots__ = ("_cache", "bit_count", "bit_index", "revolutions", "scanned", "scan_budget")
+
     def __init__(self, bits, bit_count):
-        self.bits = bits
-        while len(self.bits) > bit_count:
-            self.bits.pop()
+        self._cache = TrackCache(bits, bit_count)
         self.bit_count = bit_count
         self.bit_index = 0
         self.revolutions = 0
+        self.start_scan_budget()
+        self.invalidate()
+
+    def view(self):
+        """returns another Track on the same bitstream with its own position
+        and scan budget, sharing everything derived from the bitstream with
+        this one"""
+        view = copy.copy(self)
+        view.bit_index = 0
+        view.revolutions = 0
+        view.start_scan_budget()
+        return view
+
+    def start_scan_budget(self, bit_count=None):
+        """lets the cursor move forward |bit_count| more bits in all from here
+        (None for kScanBudgetRevolutions revolutions of the track) before it
+        raises ScanBudgetExceeded"""
+        self.scanned = 0
+        self.scan_budget = bit_count
+        if bit_count is None:
+            self.scan_budget = kScanBudgetRevolutions * self.bit_count
+
+    @property
+    def bits(self):
+        if self._cache.bits is None:
+            self._cache.bits = self._cache.padded_bits[:self.bit_count]
+            self._cache.padded_bits = None
+        return self._cache.bits
+
+    def invalidate(self):
+        """discards everything derived from self.bits, for every view of this
+        track (call this after changing bits in place)"""
+        self._cache.unrolled = None
+        self._cache.nibbles = None
+        self._cache.timing = None
+        self._cache.sync_runs = None
+        self._cache.memo = {}
+
+    def memo(self):
+        """returns dict where callers can keep their own things derived from
+        self.bits, shared by every view of this track and emptied by
+        invalidate()"""
+        return self._cache.memo
+
+    def unrolled(self):
+        """returns two revolutions of the bitstream back to back, so anything
+        that starts within the track can be read contiguously across the
+        splice point (built on first use)"""
+        if self._cache.unrolled is None:
+            self._cache.unrolled = self.bits + self.bits
+            self._cache.unrolled_bytes = (self._cache.unrolled + self.bits[:8]).tobytes() + b"\x00"
+        return self._cache.unrolled
+
+    def sync_runs(self):
+        """returns list of (bit_index, count) for each run of |count| self-sync
+        nibbles back to back, in track order. Each run covers the
+        10 * |count| bits from |bit_index| (wrapping around the splice point
+        if needed), and the gaps between runs are whatever is between the end
+        of one run and the start of the next. A track that is nothing but
+        sync is a single run starting at the first sync nibble."""
+        if self._cache.sync_runs is None:
+            bit_count = self.bit_count
+            # searching two revolutions catches sync nibbles that straddle the splice point
+            syncs = set([i % bit_count for i in self.unrolled().search(kSyncNibble)])
+            runs = []
+            for i in sorted(syncs):
+                if (i - 10) % bit_count in syncs: continue
+                count = 1
+                while (i + count * 10) % bit_count in syncs and count * 10 < bit_count:
+                    count += 1
+                runs.append((i, count))
+            if syncs and not runs:
+                i = min(syncs)
+                runs.append((i, len([j for j in syncs if (j - i) % 10 == 0])))
+            self._cache.sync_runs = runs
+        return self._cache.sync_runs
+
+    def slice(self, start_bit_index, end_bit_index):
+        """returns bitarray of the bits from |start_bit_index| up to |end_bit_index|,
+        wrapping around the splice point if |end_bit_index| comes first"""
+        start_bit_index %= self.bit_count
+        end_bit_index %= self.bit_count
+        if end_bit_index <= start_bit_index:
+            end_bit_index += self.bit_count
+        return self.unrolled()[start_bit_index:end_bit_index]
 
     def bit(self):
-        b = self.bits[self.bit_index] and 1 or 0
-        self.bit_index += 1
-        if self.bit_index >= self.bit_count:
-            self.bit_index = 0
-            self.revolutions += 1
+        b = self.peek_bit()
+        self.skip_bits(1)
         yield b
 
     def nibble(self):
-        b = 0
-        while b == 0:
-            b = next(self.bit())
-        n = 0x80
-        for bit_index in range(6, -1, -1):
-            b = next(self.bit())
-            n += b << bit_index
-        yield n
+        yield self.read_nibbles(1)[0]
 
     def rewind(self, bit_count):
-        self.bit_index -= 1
-        if self.bit_index < 0:
-            self.bit_index = self.bit_count - 1
-            self.revolutions -= 1
+        self.skip_bits(-bit_count)
+
+    def peek_bit(self):
+        """returns the bit at the current position without advancing"""
+        return self.bits[self.bit_index] and 1 or 0
+
+    def skip_bits(self, bit_count):
+        """advances |bit_count| bits (or goes back, if |bit_count| is negative)"""
+        self._seek_absolute(self.revolutions * self.bit_count + self.bit_index + bit_count)
+
+    def mark(self):
+        """returns the current position, to pass to restore() later"""
+        return (self.bit_index, self.revolutions)
+
+    def restore(self, mark):
+        self.bit_index, self.revolutions = mark
+
+    def _latch(self, position):
+        """returns (nibble, offset) for the nibble the disk controller would
+        read starting at absolute bit |position|, where |offset| is the
+        absolute bit position of the first (high) bit of that nibble"""
+        start = position % self.bit_count
+        first = self.unrolled().index(1, start) # (ValueError if there are no 1 bits at all)
+        offset = position - start + first
+        n = self._nibble_at_bit(first)
+        return n, offset
+
+    def _nibble_at_bit(self, i):
+        """returns the 8 bits starting at bit |i| (which must be less than twice bit_count) as an int"""
+        data = self._cache.unrolled_bytes
+        return (((data[i >> 3] << 8) | data[(i >> 3) + 1]) >> (8 - (i & 7))) & 0xFF
+
+    def _build_nibbles(self):
+        """latch-emulates the bitstream once, starting at bit 0 and continuing
+        past the end of the track until the framing repeats. Only that
+        repeating cycle is kept, as a bytes object of nibbles and a parallel
+        array of the absolute bit offset of the first bit of each nibble.
+        Reads that start out of step with the cycle fall back to _latch()
+        until they fall into step, which happens within a few nibbles."""
+        self._cache.nibbles = b""
+        self._cache.offsets = array.array("L")
+        self._cache.nibble_at = {}
+        self._cache.lap = self.bit_count
+        self._cache.locks = {}
+        # no 1 bits, or too few bits to hold a nibble, so no nibbles
+        if self.bit_count < 8 or not self.bits.any(): return
+        # first revolution, all at once
+        text = self.unrolled().to01()
+        text += text[:8]
+        offsets = [m.end() - 8 for m in kNibblePattern.finditer(text, 0, self.bit_count + 7)]
+        nibble_at = dict(zip(offsets, range(len(offsets))))
+        # second revolution, until it falls into step with the first
+        first = None
+        position = offsets and offsets[-1] + 8 or 0
+        for m in kNibblePattern.finditer(text, position):
+            offset = m.end() - 8
+            first = nibble_at.get(offset - self.bit_count)
+            if first is not None: break
+            offsets.append(offset)
+        if first is None:
+            # pathological track that takes more than one extra revolution
+            # to fall into step, so do it the slow way
+            position = offsets[-1] + 8
+            while True:
+                n, offset = self._latch(position)
+                first = nibble_at.get(offset % self.bit_count)
+                if first is not None: break
+                nibble_at[offset % self.bit_count] = len(offsets)
+                offsets.append(offset)
+                position = offset + 8
+        # bits covered by one pass through the cycle (a whole number of
+        # revolutions, almost always exactly one)
+        self._cache.lap = offset - offsets[first]
+        # reads from the start of the track begin with the lead-in, so index it for _align()
+        for j in range(first):
+            self._cache.locks[offsets[j] % self.bit_count] = (0, offsets[first] - offsets[j], offsets[j + 1] - offsets[j])
+        del offsets[:first]
+        bit_count = self.bit_count
+        data = self._cache.unrolled_bytes
+        self._cache.nibbles = bytes([(((data[i >> 3] << 8) | data[(i >> 3) + 1]) >> (8 - (i & 7))) & 0xFF
+                               for i in [offset % bit_count for offset in offsets]])
+        self._cache.offsets = array.array("L", offsets)
+        self._cache.nibble_at = dict(zip([offset % bit_count for offset in offsets], range(len(offsets))))
+
+    def _align(self, position, limit):
+        """returns (lead, i, shift) for reading nibbles from absolute bit
+        |position|, where |lead| is a list of (nibble, offset) pairs for the
+        out-of-step nibbles the disk controller reads first (at most |limit|
+        of them), |i| is the index of the cached nibble where it falls into
+        step, and |shift| converts that nibble's cached offset to an absolute
+        one. |i| is None if it doesn't fall into step within |limit| nibbles.
+
+        Every 1 bit that has been traced this way is indexed (in
+        self._cache.locks) with the cached nibble where its framing falls
+        into step, how far away that is, and how far away the next nibble on
+        the way is, so reading from any bit phase that leads through it later
+        costs one lookup per nibble (no searching for 1 bits). The index is
+        filled as reads need it, because tracing every 1 bit up front costs
+        more than a whole pass over the track."""
+        bit_count = self.bit_count
+        start = position % bit_count
+        offset = position - start + self.unrolled().index(1, start)
+        # trace the framing until it reaches the cached nibbles or a 1 bit
+        # that's already indexed
+        path = []
+        while offset % bit_count not in self._cache.nibble_at and offset % bit_count not in self._cache.locks:
+            if len(path) == limit:
+                return [(self._nibble_at_bit(o % bit_count), o) for o in path], None, None
+            path.append(offset)
+            offset = self._latch(offset + 8)[1]
+        i = self._cache.nibble_at.get(offset % bit_count)
+        if i is not None:
+            target = offset
+        else:
+            i, distance, step = self._cache.locks[offset % bit_count]
+            target = offset + distance
+        for o, next_offset in zip(path, path[1:] + [offset]):
+            self._cache.locks[o % bit_count] = (i, target - o, next_offset - o)
+        # then read the out-of-step nibbles on the way
+        if path:
+            offset = path[0]
+        lead = []
+        while offset < target and len(lead) < limit:
+            r = offset % bit_count
+            lead.append((self._nibble_at_bit(r), offset))
+            offset += self._cache.locks[r][2]
+        if offset < target:
+            return lead, None, None
+        return lead, i, target - self._cache.offsets[i]
+
+    def _build_timing(self):
+        """records how many 0 bits follow each cached nibble before the next
+        one starts (timing bits), as a bytes object of (nibble, zeros) pairs
+        in cycle order, with zeros capped at 255"""
+        offsets = self._cache.offsets.tolist()
+        offsets.append(offsets[0] + self._cache.lap)
+        timing = bytearray(2 * len(self._cache.nibbles))
+        timing[0::2] = self._cache.nibbles
+        timing[1::2] = bytes([min(offsets[i + 1] - offsets[i] - 8, 255) for i in range(len(self._cache.nibbles))])
+        self._cache.timing = bytes(timing)
+
+    def _zeros_after(self, offset):
+        """returns how many 0 bits follow the nibble that starts at absolute bit |offset|"""
+        start = (offset + 8) % self.bit_count
+        return self.unrolled().index(1, start) - start
+
+    def _offset_of(self, i):
+        """returns absolute bit offset of the first bit of cached nibble |i|, where |i| may run past the end of the cycle"""
+        laps, i = divmod(i, len(self._cache.nibbles))
+        return self._cache.offsets[i] + laps * self._cache.lap
+
+    def _index_at_or_after(self, offset):
+        """returns index of the first cached nibble that starts at or after absolute bit |offset|"""
+        laps, r = divmod(offset - self._cache.offsets[0], self._cache.lap)
+        return laps * len(self._cache.nibbles) + bisect.bisect_left(self._cache.offsets, self._cache.offsets[0] + r)
+
+    def _cached_nibbles(self, start, stop):
+        """returns bytes object of cached nibbles |start| to |stop|, wrapping around the cycle as needed"""
+        first = start % len(self._cache.nibbles)
+        count = stop - start
+        return (self._cache.nibbles * ((first + count) // len(self._cache.nibbles) + 1))[first:first + count]
+
+    def _seek_absolute(self, position):
+        advance = position - (self.revolutions * self.bit_count + self.bit_index)
+        self.revolutions, self.bit_index = divmod(position, self.bit_count)
+        if advance > 0:
+            self.scanned += advance
+            if self.scan_budget is not None and self.scanned > self.scan_budget:
+                raise ScanBudgetExceeded("scanned %d bits of a %d-bit track" % (self.scanned, self.bit_count))
+
+    def cycle(self):
+        """returns bytes object of the nibbles the disk controller reads in
+        one revolution once it's in step with the bitstream, or None if it
+        takes more than one revolution to repeat itself"""
+        if self._cache.nibbles is None:
+            self._build_nibbles()
+        if self._cache.lap != self.bit_count:
+            return None
+        return self._cache.nibbles
+
+    def cycle_index(self):
+        """returns index of the cycle() nibble the next read starts with,
+        counting on through later revolutions (so it can be past the end of
+        the cycle), or None if the current position is out of step"""
+        if not self.cycle():
+            return None
+        position = self.revolutions * self.bit_count + self.bit_index
+        i = self._index_at_or_after(position)
+        if self._offset_of(i - 1) + 8 > position:
+            return None
+        return i
+
+    def cycle_bit_index(self, i):
+        """returns bit index of the first bit of cycle() nibble |i|"""
+        return self._offset_of(i) % self.bit_count
+
+    def seek_cycle_index(self, i):
+        """moves to where the next read starts with cycle() nibble |i|, as
+        returned by cycle_index()"""
+        self._seek_absolute(self._offset_of(i - 1) + 8)
+
+    def find_cycle(self, starts, length):
+        """like find_any(), for sequences of |length| nibbles that are already
+        known to start at cycle() indexes |starts| (sorted, all less than
+        len(cycle())), so nothing needs searching. Returns None without
+        moving if the current position is out of step."""
+        i = self.cycle_index()
+        if i is None:
+            return None
+        stop = (self.revolutions + 2) * self.bit_count
+        last = max(i, self._index_at_or_after(stop - 8))
+        if starts:
+            laps, r = divmod(i, len(self._cache.nibbles))
+            k = bisect.bisect_left(starts, r)
+            if k < len(starts):
+                start = laps * len(self._cache.nibbles) + starts[k]
+            else:
+                start = (laps + 1) * len(self._cache.nibbles) + starts[0]
+            if start + length - 1 <= last:
+                self.seek_cycle_index(start + length)
+                return True
+        self.seek_cycle_index(last + 1)
+        return False
+
+    def read_nibbles(self, count):
+        """returns bytes object of the next |count| nibbles and advances past them"""
+        if self._cache.nibbles is None:
+            self._build_nibbles()
+        position = self.revolutions * self.bit_count + self.bit_index
+        if count <= 0 or not self._cache.nibbles:
+            # (no nibbles at all on a track with no 1 bits, or too short to hold one)
+            return b""
+        lead, i, shift = self._align(position, count)
+        nibbles = bytes([n for n, offset in lead])
+        if len(nibbles) == count:
+            position = lead[-1][1] + 8
+        else:
+            last = i + count - len(nibbles) - 1
+            nibbles += self._cached_nibbles(i, last + 1)
+            position = self._offset_of(last) + 8 + shift
+        self._seek_absolute(position)
+        return nibbles
+
+    def read_nibble_span(self, bit_count):
+        """returns (nibbles, offsets) for every nibble read from here until the
+        cursor is |bit_count| bits further on (the last one can end past
+        that), and advances past them, where |nibbles| is a bytes object and
+        |offsets| is a list of the absolute bit position of the first (high)
+        bit of each nibble. Same as calling read_nibbles(1) while the cursor
+        is short of that point, but all at once."""
+        if self._cache.nibbles is None:
+            self._build_nibbles()
+        position = self.revolutions * self.bit_count + self.bit_index
+        stop = position + bit_count
+        if not self._cache.nibbles:
+            self._seek_absolute(max(position, stop))
+            return b"", []
+        nibbles = b""
+        offsets = []
+        lead, i, shift = self._align(position, (stop - position + 7) // 8)
+        for n, offset in lead:
+            if position >= stop: break
+            nibbles += bytes((n,))
+            offsets.append(offset)
+            position = offset + 8
+        if i is not None and position < stop:
+            last = max(i, self._index_at_or_after(stop - 8 - shift))
+            nibbles += self._cached_nibbles(i, last + 1)
+            offsets.extend([self._offset_of(j) + shift for j in range(i, last + 1)])
+            position = offsets[-1] + 8
+        self._seek_absolute(position)
+        return nibbles, offsets
+
+    def find_weak_bits(self, valid_nibbles, bit_count):
+        """returns list of (start, stop) absolute bit positions of the weak
+        bits in the next |bit_count| bits (pass self.bit_count for the whole
+        track), in track order, and advances past them like
+        read_nibble_span(), except that a nibble starting after those bits
+        (like the next address prologue after a field of 0s) is left for
+        the next read. Weak bits are runs of more than two 0 bits (see
+        kWeakZeroRunPattern) and runs of nibbles that aren't in
+        |valid_nibbles| (the random 1 bits the drive read there when the
+        disk was imaged), merged where they touch, all found in one pass
+        over the nibbles and one over the bits."""
+        position = self.revolutions * self.bit_count + self.bit_index
+        nibbles, offsets = self.read_nibble_span(bit_count)
+        count = bisect.bisect_left(offsets, position + bit_count)
+        if count < len(offsets):
+            nibbles, offsets = nibbles[:count], offsets[:count]
+            self._seek_absolute(max([position + bit_count] + [offset + 8 for offset in offsets[-1:]]))
+        invalid = bytes([n not in valid_nibbles for n in range(0x100)])
+        ranges = [(offsets[m.start()], offsets[m.end() - 1] + 8) for m in re.finditer(b"\x01+", nibbles.translate(invalid))]
+        start = position % self.bit_count
+        text = self.unrolled()[start:start + min(bit_count, self.bit_count)].to01()
+        ranges.extend([(position + m.start(), position + m.end()) for m in kWeakZeroRunPattern.finditer(text)])
+        merged = []
+        for start, stop in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+            else:
+                merged.append((start, stop))
+        return merged
+
+    def zero_bits(self, ranges):
+        """sets every bit in each (start, stop) range of absolute bit positions
+        in |ranges| to 0, wrapping around the splice point, then
+        invalidate()s if that changed anything. Returns list of (bit_index,
+        bit_count) for each range that had any 1 bits to clean, in track
+        order, with ranges that straddle the splice point split in two."""
+        zeroed = []
+        for start, stop in ranges:
+            start, stop = start % self.bit_count, start % self.bit_count + min(stop - start, self.bit_count)
+            if stop > self.bit_count:
+                zeroed.append((0, stop - self.bit_count))
+                stop = self.bit_count
+            zeroed.append((start, stop - start))
+        zeroed = [(bit_index, bit_count) for bit_index, bit_count in sorted(zeroed)
+                  if self.bits[bit_index:bit_index + bit_count].any()]
+        for bit_index, bit_count in zeroed:
+            self.bits[bit_index:bit_index + bit_count] = 0
+        if zeroed:
+            self.invalidate()
+        return zeroed
 
     def find(self, sequence):
-        starting_revolutions = self.revolutions
-        seen = [0] * len(sequence)
-        while (self.revolutions < starting_revolutions + 2):
-            del seen[0]
-            seen.append(next(self.nibble()))
-            if tuple(seen) == tuple(sequence): return True
-        return False
+        return self.find_any((sequence,))
+
+    def find_any(self, sequences):
+        """advances past the first occurrence of any of |sequences| within the
+        next 2 revolutions and returns True, or returns False if there isn't one"""
+        if self._cache.nibbles is None:
+            self._build_nibbles()
+        patterns = [bytes(sequence) for sequence in sequences]
+        position = self.revolutions * self.bit_count + self.bit_index
+        stop = (self.revolutions + 2) * self.bit_count
+        if not self._cache.nibbles:
+            # no 1 bits at all, so no nibbles
+            self._seek_absolute(max(position, stop))
+            return False
+        # check the out-of-step nibbles the controller reads before it falls
+        # into step with the cached nibbles
+        seen = b""
+        lead, i, shift = self._align(position, (stop - position + 7) // 8)
+        for n, offset in lead:
+            if position >= stop: break
+            seen = seen + bytes((n,))
+            position = offset + 8
+            if any(seen.endswith(p) for p in patterns):
+                self._seek_absolute(position)
+                return True
+        if i is None or position >= stop:
+            self._seek_absolute(position)
+            return False
+        # search the cached nibbles, up to and including the last nibble that
+        # starts reading before the stop point
+        last = max(i, self._index_at_or_after(stop - 8 - shift))
+        haystack = seen + self._cached_nibbles(i, last + 1)
+        ends = [haystack.find(p) + len(p) for p in patterns if p in haystack]
+        if ends:
+            last = i + min(ends) - len(seen) - 1
+        self._seek_absolute(self._offset_of(last) + 8 + shift)
+        return bool(ends)
+
+    def find_timed(self, sequence):
+        """like find(), but |sequence| is a sequence of (nibble, zeros) pairs,
+        and each nibble only matches if at least |zeros| 0 bits (timing bits)
+        follow it before the next nibble starts. Advances past the last
+        nibble of the first match, not past its timing bits."""
+        if self._cache.nibbles is None:
+            self._build_nibbles()
+        if self._cache.timing is None:
+            self._build_timing()
+        pattern = b"".join([re.escape(bytes((n,))) + (zeros and b"[" + re.escape(bytes((min(zeros, 255),))) + b"-\xff]" or b".")
+                            for n, zeros in sequence])
+        pattern = re.compile(pattern, re.DOTALL)
+        position = self.revolutions * self.bit_count + self.bit_index
+        stop = (self.revolutions + 2) * self.bit_count
+        if not self._cache.nibbles:
+            self._seek_absolute(max(position, stop))
+            return False
+        # check the out-of-step nibbles the controller reads before it falls
+        # into step with the cached nibbles
+        seen = b""
+        lead, i, shift = self._align(position, (stop - position + 7) // 8)
+        for n, offset in lead:
+            if position >= stop: break
+            seen = seen + bytes((n, min(self._zeros_after(offset), 255)))
+            position = offset + 8
+            if pattern.fullmatch(seen, max(0, len(seen) - 2 * len(sequence))):
+                self._seek_absolute(position)
+                return True
+        if i is None or position >= stop:
+            self._seek_absolute(position)
+            return False
+        # search the cached (nibble, zeros) pairs, only matching on pair boundaries
+        last = max(i, self._index_at_or_after(stop - 8 - shift))
+        first = i % len(self._cache.nibbles)
+        count = last + 1 - i
+        haystack = seen + (self._cache.timing * ((first + count) // len(self._cache.nibbles) + 1))[2 * first:2 * (first + count)]
+        m = re.compile(b"(?:..)*?" + pattern.pattern, re.DOTALL).match(haystack)
+        if m:
+            last = i + m.end() // 2 - len(seen) // 2 - 1
+        self._seek_absolute(self._offset_of(last) + 8 + shift)
+        return bool(m)
 
 class WozDiskImage:
     def __init__(self, iostream=None):
@@ -196,6 +729,7 @@ class WozDiskImage:
         self.info = collections.OrderedDict()
         self.tmap = [0xFF]*160
         self.tracks = []
+        self.views = {}
         self.writ = None
         self.meta = collections.OrderedDict()
         self.woz_version = 2
@@ -213,49 +747,54 @@ class WozDiskImage:
 
     def load(self, iostream):
         self.reset()
+        # the file is read once, and chunks and track bitstreams are sliced
+        # out of that in place
+        self._load_image(read_stream(iostream))
+
+    def _load_image(self, image):
         seen_info = False
         seen_tmap = False
-        header_raw = iostream.read(8)
+        header_raw = bytes(image[:8])
         raise_if(len(header_raw) != 8, WozEOFError, sEOF)
         self._load_header(header_raw)
-        crc_raw = iostream.read(4)
+        crc_raw = bytes(image[8:12])
         raise_if(len(crc_raw) != 4, WozEOFError, sEOF)
         crc = from_uint32(crc_raw)
-        all_data = []
-        while True:
-            chunk_id = iostream.read(4)
-            if not chunk_id: break
+        data_crc = 0
+        i = 12
+        while i < len(image):
+            chunk_id = bytes(image[i:i+4])
             raise_if(len(chunk_id) != 4, WozEOFError, sEOF)
-            all_data.append(chunk_id)
-            chunk_size_raw = iostream.read(4)
+            chunk_size_raw = bytes(image[i+4:i+8])
             raise_if(len(chunk_size_raw) != 4, WozEOFError, sEOF)
-            all_data.append(chunk_size_raw)
             chunk_size = from_uint32(chunk_size_raw)
-            data = iostream.read(chunk_size)
+            data = image[i+8:i+8+chunk_size]
             raise_if(len(data) != chunk_size, WozEOFError, sEOF)
-            all_data.append(data)
+            if crc:
+                data_crc = binascii.crc32(image[i:i+8+chunk_size], data_crc)
+            i += 8 + chunk_size
             if chunk_id == kINFO:
                 raise_if(chunk_size != 60, WozINFOFormatError, sBadChunkSize)
-                self._load_info(data)
+                self._load_info(bytes(data))
                 seen_info = True
                 continue
             raise_if(not seen_info, WozINFOFormatError_MissingINFOChunk, "Expected INFO chunk at offset 20")
             if chunk_id == kTMAP:
                 raise_if(chunk_size != 160, WozTMAPFormatError, sBadChunkSize)
-                self._load_tmap(data)
+                self._load_tmap(bytes(data))
                 seen_tmap = True
                 continue
             raise_if(not seen_tmap, WozTMAPFormatError_MissingTMAPChunk, "Expected TMAP chunk at offset 88")
             if chunk_id == kTRKS:
                 self._load_trks(data)
             elif chunk_id == kWRIT:
-                self._load_writ(data)
+                self._load_writ(bytes(data))
             elif chunk_id == kMETA:
-                self._load_meta(data)
+                self._load_meta(bytes(data))
         raise_if(not seen_info, WozINFOFormatError_MissingINFOChunk, "Expected INFO chunk at offset 20")
         raise_if(not seen_tmap, WozTMAPFormatError_MissingTMAPChunk, "Expected TMAP chunk at offset 88")
         if crc:
-            raise_if(crc != binascii.crc32(b"".join(all_data)) & 0xffffffff, WozCRCError, "Bad CRC")
+            raise_if(crc != data_crc & 0xffffffff, WozCRCError, "Bad CRC")
 
     def _load_header(self, data):
         raise_if(data[:4] not in (kWOZ1, kWOZ2), WozHeaderError_NoWOZMarker, "Magic string 'WOZ1' or 'WOZ2' not present at offset 0")
@@ -321,9 +860,7 @@ class WozDiskImage:
             if splice_point != 0xFFFF:
                 raise_if(splice_bit_count not in (8,9,10), WozTRKSFormatError, "TRKS chunk %d splice_bit_count is out of range" % len(self.tracks))
             i += 3
-            bits = bitarray.bitarray(endian="big")
-            bits.frombytes(raw_bytes)
-            self.tracks.append(Track(bits, bit_count))
+            self.tracks.append(Track(bits_from_buffer(raw_bytes), bit_count))
 
     def _load_trks_v2(self, data):
         for trk in range(160):
@@ -340,9 +877,7 @@ class WozDiskImage:
             raise_if(len(data) <= bits_index_into_data, WozTRKSFormatError_BadStartingBlock, sEOF)
             raw_bytes = data[bits_index_into_data : bits_index_into_data + block_count*512]
             raise_if(len(raw_bytes) != block_count*512, WozTRKSFormatError_BadBlockCount, sEOF)
-            bits = bitarray.bitarray(endian="big")
-            bits.frombytes(raw_bytes)
-            self.tracks.append(Track(bits, bit_count))
+            self.tracks.append(Track(bits_from_buffer(raw_bytes), bit_count))
 
     def _load_writ(self, data):
         self.writ = data
@@ -578,7 +1113,7 @@ class WozDiskImage:
             block_size = len(padded_bytes) // 512
             starting_block += block_size
             trk_chunk.extend(to_uint16(block_size))
-            trk_chunk.extend(to_uint32(track.bits.length()))
+            trk_chunk.extend(to_uint32(len(track.bits)))
             bits_chunk.extend(padded_bytes)
         for i in range(len(self.tracks), 160):
             trk_chunk.extend(to_uint16(0))
@@ -684,7 +1219,14 @@ class WozDiskImage:
         half_phase = self.track_num_to_half_phase(track_num)
         trk_id = self.tmap[half_phase]
         if trk_id == 0xFF: return None
-        return self.tracks[trk_id]
+        # each track position gets its own view of the track, so positions
+        # that share a TRKS entry share its analysis but not the read position
+        track, view = self.views.get(half_phase, (None, None))
+        if track is not self.tracks[trk_id]:
+            track = self.tracks[trk_id]
+            view = track.view()
+            self.views[half_phase] = (track, view)
+        return view
 
     def from_json(self, json_string):
         j = json.loads(json_string)
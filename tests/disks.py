@@ -0,0 +1,84 @@
+"""builds synthetic disk images for the tests"""
+import bitarray
+import random
+from passport import wozardry
+from passport.rwts import RWTS, DOS32RWTS
+
+kWrite62 = {v: n for n, v in RWTS.kDefaultNibbleTranslationTable16.items()}
+kWrite53 = {v: n for n, v in DOS32RWTS.kDefaultNibbleTranslationTable13.items()}
+
+def encode44(v):
+    return [(v >> 1) | 0xAA, v | 0xAA]
+
+def xor_encode(values, write):
+    """returns nibbles for |values|, each XORed with the one before it, and
+    then the checksum nibble"""
+    nibbles = []
+    last = 0
+    for v in values:
+        nibbles.append(write[v ^ last])
+        last = v
+    nibbles.append(write[last])
+    return nibbles
+
+def encode62(data):
+    auxiliary = [0] * 86
+    for i, v in enumerate(data):
+        auxiliary[i % 86] |= (((v & 1) << 1) | ((v & 2) >> 1)) << (2 * (i // 86))
+    return xor_encode(auxiliary + [v >> 2 for v in data], kWrite62)
+
+def encode53(data):
+    base = [0] * 256
+    threes = [0] * 154
+    for i in range(51):
+        d = data[5 * (50 - i):5 * (50 - i) + 5]
+        for k in range(5):
+            base[51 * k + i] = d[k] >> 3
+        for k in range(3):
+            threes[51 * k + i] = ((d[k] & 7) << 2) | (((d[3] >> (2 - k)) & 1) << 1) | ((d[4] >> (2 - k)) & 1)
+    threes[153] = data[255] & 7
+    base[255] = data[255] >> 3
+    return xor_encode(threes[::-1] + base, kWrite53)
+
+def sync(count):
+    return "1111111100" * count
+
+def nibbles(seq):
+    return "".join([format(n, "08b") for n in seq])
+
+def build_track(rng, track_num, sectors, thirteen=False, address_epilogue=(0xDE, 0xAA, 0xEB)):
+    """returns bit string of a track holding |sectors| (list of 256-byte
+    bytes objects, in physical order), starting at a random point"""
+    address_prologue = thirteen and (0xD5, 0xAA, 0xB5) or (0xD5, 0xAA, 0x96)
+    bits = sync(rng.randint(40, 80))
+    for sector_num, data in enumerate(sectors):
+        bits += nibbles(address_prologue) + \
+            nibbles(encode44(254) + encode44(track_num) + encode44(sector_num) + encode44(254 ^ track_num ^ sector_num)) + \
+            nibbles(address_epilogue) + sync(6)
+        bits += nibbles((0xD5, 0xAA, 0xAD)) + nibbles(thirteen and encode53(data) or encode62(data)) + \
+            nibbles((0xDE, 0xAA, 0xEB)) + sync(rng.randint(14, 22))
+    start = rng.randrange(len(bits))
+    return bits[start:] + bits[:start]
+
+def find_data_field(bits, track_num, sector_num):
+    """returns index in |bits| of the first nibble of the data field after
+    the address field of |sector_num|"""
+    address = nibbles(encode44(254) + encode44(track_num) + encode44(sector_num))
+    return bits.index(nibbles((0xD5, 0xAA, 0xAD)), bits.index(address)) + 24
+
+def damage(bits, track_num, sector_num):
+    """returns |bits| with a nibble that isn't valid at the start of the data
+    field of |sector_num|"""
+    i = find_data_field(bits, track_num, sector_num)
+    return bits[:i] + nibbles((0xAA,)) + bits[i + 8:]
+
+def random_sectors(rng, count):
+    return [rng.random() < 0.8 and bytes([rng.getrandbits(8) for i in range(256)]) or bytes(256) for k in range(count)]
+
+def write_woz(path, tracks):
+    """writes .woz image of |tracks| (dict of track number to bit string)"""
+    woz = wozardry.WozDiskImage()
+    for track_num, bits in sorted(tracks.items()):
+        woz.add_track(track_num, wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits)))
+    with open(path, "wb") as f:
+        f.write(bytes(woz))
@@ -0,0 +1,72 @@
+import random
+from passport import wozardry, Verify, Crack, Convert
+from disks import build_track, damage, encode44, nibbles, random_sectors, sync, write_woz
+
+def run(processor, path):
+    with open(path, "rb") as f:
+        processor(str(path), wozardry.WozDiskImage(f))
+
+def make_disk(path, seed, special={}):
+    """writes a 13-sector .woz image, returning its sectors"""
+    rng = random.Random(seed)
+    sectors = {track_num: random_sectors(rng, 13) for track_num in range(35)}
+    write_woz(path, {track_num: build_track(rng, track_num, sectors[track_num], thirteen=True, **special.get(track_num, {}))
+                     for track_num in range(35)})
+    return sectors
+
+def test_convert_13_sector(tmp_path, capsys):
+    # seed 3 used to leave track 0 where the 13-sector check stopped, so
+    # Convert (which burns 2 sectors) ran out of track
+    for seed in range(8):
+        path = tmp_path / ("disk%d.woz" % seed)
+        make_disk(path, seed)
+        run(Verify, path)
+        assert "The disk is good" in capsys.readouterr().out
+        run(Convert, path)
+        assert "Writing to" in capsys.readouterr().out
+        with open(path, "rb") as f:
+            assert wozardry.WozDiskImage(f).seek(0).bits
+
+def test_crack_13_sector(tmp_path, capsys):
+    path = tmp_path / "disk.woz"
+    sectors = make_disk(path, 0)
+    run(Crack, path)
+    assert "Found DOS 3.2 bootloader" in capsys.readouterr().out
+    assert (tmp_path / "disk.d13").read_bytes() == b"".join([b"".join(sectors[track_num]) for track_num in range(35)])
+
+def test_13_sector_fallback(tmp_path, capsys):
+    # tracks the standard RWTS rejects fall back to the 13-sector built-in
+    # ones (the one that ignores epilogues, for track 0), not 16-sector ones
+    path = tmp_path / "disk.woz"
+    make_disk(path, 0, dict([(track_num, {"address_epilogue": (0xDF, 0xAA, 0xEB)}) for track_num in range(1, 0x12)]))
+    for processor in (Verify, Convert):
+        run(processor, path)
+        out = capsys.readouterr().out
+        assert "T11,S0C Switching to built-in RWTS" in out and "Fatal" not in out
+
+def test_13_sector_skiptrack(tmp_path, capsys):
+    # a track that has its last sector ($0C) but can't read another one
+    # isn't checked for whole-track protections (it used to be, because
+    # $0F was missing), even with a long run of sync nibbles on it
+    path = tmp_path / "disk.woz"
+    rng = random.Random(9)
+    tracks = {track_num: build_track(rng, track_num, random_sectors(rng, 13), thirteen=True) for track_num in range(35)}
+    i = tracks[5].index(nibbles((0xD5, 0xAA, 0xB5) + tuple(encode44(254) + encode44(5) + encode44(0))))
+    tracks[5] = damage(tracks[5][:i] + sync(600) + tracks[5][i:], 5, 3)
+    write_woz(path, tracks)
+    run(Verify, path)
+    out = capsys.readouterr().out
+    assert "nibble count" not in out and "T05,S00 Switching to built-in RWTS" in out and "Fatal read error" in out
+
+def test_13_sector_track_22(tmp_path, capsys):
+    # only a missing $0C on track $22 means Passport can't read the disk
+    for sector_num in (3, 12):
+        path = tmp_path / "disk.woz"
+        rng = random.Random(10)
+        tracks = {track_num: build_track(rng, track_num, random_sectors(rng, 13), thirteen=True) for track_num in range(35)}
+        tracks[0x22] = damage(tracks[0x22], 0x22, sector_num)
+        write_woz(path, tracks)
+        run(Verify, path)
+        out = capsys.readouterr().out
+        assert "Fatal read error" in out and "S0F" not in out
+        assert ("T22,S0C Fatal read error" in out and "Passport does not work" in out) == (sector_num == 12)
@@ -0,0 +1,28 @@
+import bitarray
+import random
+from passport import eddimage
+from disks import build_track, random_sectors, sync
+
+def capture(revolution):
+    """returns bitarray of a capture as long as an .edd track, of a disk
+    that reads |revolution| (bit string) over and over"""
+    bits = revolution * (eddimage.kCaptureBits // len(revolution) + 1)
+    return bitarray.bitarray(bits[:eddimage.kCaptureBits], endian="big")
+
+def test_revolution_with_long_sync_and_zero_regions():
+    # the probes in the first 22000 bits all land in sync nibbles or zero
+    # bits, which repeat too often to say how long the revolution is
+    rng = random.Random(6)
+    revolution = sync(1300) + "0" * 9000 + build_track(rng, 5, random_sectors(rng, 10))
+    assert eddimage.find_revolution(capture(revolution)) == len(revolution)
+
+def test_revolution_of_formatted_track():
+    rng = random.Random(7)
+    revolution = build_track(rng, 5, random_sectors(rng, 16))
+    assert eddimage.find_revolution(capture(revolution)) == len(revolution)
+
+def test_no_revolution():
+    rng = random.Random(8)
+    noise = bitarray.bitarray([rng.random() < 0.5 for i in range(eddimage.kCaptureBits)], endian="big")
+    assert eddimage.find_revolution(noise) is None
+    assert eddimage.find_revolution(capture(sync(100))) is None
@@ -0,0 +1,47 @@
+import bitarray
+import random
+from passport import PassportGlobals, wozardry
+from passport.loggers import DefaultLogger
+from passport.rwts import HeredityDogRWTS, RWTS
+from disks import nibbles, sync
+
+def rwts(g):
+    # a DOS 3.3 RWTS (sectors 2, 3 and 4 are where it keeps its prologues,
+    # epilogues and nibble translate table), where the table has 0xFF for
+    # nibbles that aren't valid
+    logical_sectors = dict([(sector_num, bytearray(256)) for sector_num in (2, 3, 4)])
+    logical_sectors[2][0xE7], logical_sectors[2][0xF1], logical_sectors[2][0xFC] = 0xD5, 0xAA, 0xAD
+    logical_sectors[3][0x55], logical_sectors[3][0x5F], logical_sectors[3][0x6A] = 0xD5, 0xAA, 0x96
+    logical_sectors[3][0x91], logical_sectors[3][0x9B] = 0xDE, 0xAA
+    logical_sectors[3][0x35], logical_sectors[3][0x3F] = 0xDE, 0xAA
+    logical_sectors[4][0x96:] = [RWTS.kDefaultNibbleTranslationTable16.get(n, 0xFF) for n in range(0x96, 0x100)]
+    return HeredityDogRWTS(logical_sectors, g)
+
+def test_fake_sector_is_cleaned():
+    # the fake data field is all 0s but for stray 1 bits, too far apart to
+    # make a valid nibble, and the next address field has to come through
+    # untouched
+    rng = random.Random(11)
+    fake = ""
+    while len(fake) < 343*8 - 40:
+        fake += "1" + "0" * rng.randint(8, 30)
+    fake += "0" * (343*8 - len(fake))
+    bits = fake + nibbles((0xD5, 0xAA, 0x96)) + sync(200)
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    g = PassportGlobals()
+    g.logger = DefaultLogger(g)
+    assert rwts(g).data_field_at_point(track, 0x00, 0x0A) == bytearray(256)
+    assert g.found_and_cleaned_weakbits
+    assert sum([bit_count for track_num, bit_index, bit_count in g.cleaned_weakbits]) <= 343*8 + 8
+    assert not track.bits[:343*8].any()
+    assert track.bits[343*8:] == bitarray.bitarray(bits[343*8:])
+    assert track.find((0xD5, 0xAA, 0x96)) and track.revolutions == 0
+
+def test_clean_fake_sector():
+    # nothing to clean, so the image isn't marked as cleaned
+    bits = "0" * 343*8 + nibbles((0xD5, 0xAA, 0x96)) + sync(200)
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    g = PassportGlobals()
+    g.logger = DefaultLogger(g)
+    rwts(g).data_field_at_point(track, 0x00, 0x0A)
+    assert not g.found_and_cleaned_weakbits and not g.cleaned_weakbits
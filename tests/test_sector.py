@@ -0,0 +1,23 @@
+import bitarray
+import random
+from passport import PassportGlobals, wozardry
+from passport.loggers import DefaultLogger
+from passport.rwts import RWTS
+from passport.util import concat_track
+from disks import build_track, random_sectors
+
+def test_sectors_share_one_buffer():
+    rng = random.Random(12)
+    sectors = random_sectors(rng, 16)
+    bits = build_track(rng, 5, sectors)
+    g = PassportGlobals()
+    g.logger = DefaultLogger(g)
+    rwts = RWTS(g)
+    found = rwts.decode_track(wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits)), 5)
+    assert len(set([id(sector.decoded.obj) for sector in found.values()])) == 1
+    # patching one sector leaves the others alone
+    found[3].decoded[0:4] = b"\x4C\x59\xFF\x00"
+    assert bytes(found[3].decoded[:4]) == b"\x4C\x59\xFF\x00" and bytes(found[3].decoded[4:]) == sectors[3][4:]
+    assert all([bytes(found[sector_num].decoded) == sectors[sector_num] for sector_num in range(16) if sector_num != 3])
+    logical = rwts.reorder_to_logical_sectors(found)
+    assert concat_track(logical)[256 * RWTS.kDefaultSectorOrder16[4]:256 * (RWTS.kDefaultSectorOrder16[4] + 1)] == sectors[4]
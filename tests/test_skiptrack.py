@@ -0,0 +1,68 @@
+import bitarray
+import random
+from passport import wozardry, BasePassportProcessor, Verify, Convert
+from passport.loggers import DefaultLogger
+from passport.rwts import RWTS, track_stats
+from disks import build_track, random_sectors, sync, write_woz
+
+class Idle(BasePassportProcessor):
+    """a processor that doesn't read anything, for calling SkipTrack()"""
+    def preprocess(self):
+        return False
+
+def noise_track(rng):
+    bits = bitarray.bitarray([rng.random() < 0.5 for i in range(51200)], endian="big")
+    return wozardry.Track(bits, len(bits))
+
+def test_unformatted_ignores_disk_translate_table(capsys):
+    rng = random.Random(1)
+    track = noise_track(rng)
+    processor = Idle("disk.woz", None, DefaultLogger)
+    for table in (RWTS.kDefaultNibbleTranslationTable16,
+                  # a disk could supply a table that makes any nibble valid
+                  dict([(n, n & 0x3F) for n in range(0x80, 0x100)])):
+        processor.rwts = RWTS(processor.g, nibble_translate_table=table)
+        assert processor.SkipTrack(5, track)
+    assert not processor.SkipTrack(0, track)
+
+def test_nibble_count_track(capsys):
+    processor = Idle("disk.woz", None, DefaultLogger)
+    processor.rwts = RWTS(processor.g)
+    rng = random.Random(3)
+    for count, skipped in ((600, True), (500, False)):
+        bits = build_track(rng, 5, random_sectors(rng, 10)) + sync(count)
+        assert processor.SkipTrack(5, wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))) == skipped
+        assert ("nibble count" in capsys.readouterr().out) == skipped
+
+def test_unformatted_track(tmp_path, capsys):
+    rng = random.Random(2)
+    tracks = dict([(track_num, build_track(rng, track_num, random_sectors(rng, 16))) for track_num in range(35)])
+    tracks[5] = noise_track(rng).bits.to01()
+    path = tmp_path / "disk.woz"
+    write_woz(path, tracks)
+    with open(path, "rb") as f:
+        Verify(str(path), wozardry.WozDiskImage(f))
+    out = capsys.readouterr().out
+    assert "T05 is unformatted" in out and "The disk is good" in out
+
+def test_convert_after_skiptrack(tmp_path, capsys):
+    # track $11 can't be read by the disk's own RWTS (its address epilogues
+    # are nonstandard), goes through SkipTrack() without being skipped, and
+    # is read by the built-in RWTS starting from wherever the one before it
+    # left off, which SkipTrack() doesn't change. That decides the order the
+    # sectors are written in.
+    rng = random.Random(0)
+    epilogue = {"address_epilogue": (0xDF, 0xAA, 0xEB)}
+    tracks = dict([(track_num, build_track(rng, track_num, random_sectors(rng, 13), True, **(0 < track_num < 0x12 and epilogue or {})))
+                   for track_num in range(35)])
+    path = tmp_path / "disk.woz"
+    write_woz(path, tracks)
+    with open(path, "rb") as f:
+        Convert(str(path), wozardry.WozDiskImage(f))
+    assert "T11,S0C Switching to built-in RWTS" in capsys.readouterr().out
+    with open(path, "rb") as f:
+        track = wozardry.WozDiskImage(f).seek(0x11)
+    # (moving the cursor to the start of a later revolution in SkipTrack()
+    # would start this at sector $0A instead)
+    assert [sector_num for track_num, sector_num in track_stats(track).address_fields((b"\xD5\xAA\xB5",))] == \
+        [11, 12, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
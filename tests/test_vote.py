@@ -0,0 +1,58 @@
+import bitarray
+import random
+from passport import PassportGlobals, wozardry
+from passport.loggers import DefaultLogger
+from passport.rwts import RWTS
+from disks import build_track, encode44, encode62, kWrite62, nibbles, random_sectors
+
+def bad_checksum(bits, sector_num, data, position=0):
+    """returns |bits| with nibble |position| of the data field of
+    |sector_num| changed, so its nibbles are all still valid but its
+    checksum is wrong"""
+    address = nibbles(encode44(254) + encode44(5) + encode44(sector_num))
+    field = encode62(data)
+    i = bits.index(nibbles(field), bits.index(address)) + 8 * position
+    other = [n for n in kWrite62.values() if n != field[position]][0]
+    return bits[:i] + nibbles((other,)) + bits[i + 8:]
+
+def rwts():
+    g = PassportGlobals()
+    g.logger = DefaultLogger(g)
+    return RWTS(g)
+
+def test_vote_replaces_bad_checksum():
+    rng = random.Random(4)
+    sectors = random_sectors(rng, 16)
+    good = build_track(rng, 5, sectors)
+    bits = bad_checksum(good, 9, sectors[9]) + good + good
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    found = rwts().decode_track(track, 5)
+    assert not found[9].checksum_valid
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    found = rwts().decode_track(track, 5, vote=True)
+    assert sorted(found) == list(range(16))
+    assert all([found[sector_num].checksum_valid and bytes(found[sector_num].decoded) == sectors[sector_num]
+                for sector_num in range(16)])
+
+def test_vote_combines_copies():
+    # no one copy of sector 9 has the right checksum, but each has a
+    # different nibble wrong, so the vote puts it back together
+    rng = random.Random(5)
+    sectors = random_sectors(rng, 16)
+    good = build_track(rng, 5, sectors)
+    bits = "".join([bad_checksum(good, 9, sectors[9], position) for position in (0, 100, 300)])
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    assert not rwts().decode_track(track, 5)[9].checksum_valid
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    found = rwts().decode_track(track, 5, vote=True)
+    assert found[9].checksum_valid and bytes(found[9].decoded) == sectors[9]
+
+def test_vote_needs_a_good_checksum():
+    rng = random.Random(4)
+    sectors = random_sectors(rng, 16)
+    good = build_track(rng, 5, sectors)
+    bad = bad_checksum(good, 9, sectors[9])
+    bits = bad + bad
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    found = rwts().decode_track(track, 5, vote=True)
+    assert 9 not in found and len(found) == 15
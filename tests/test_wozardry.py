@@ -0,0 +1,67 @@
+import bitarray
+import gc
+import mmap
+from passport import eddimage, wozardry
+
+def test_track_too_short_for_a_nibble():
+    for bits in ("1", "11", "1111111"):
+        track = wozardry.Track(bitarray.bitarray(bits), len(bits))
+        assert track.cycle() == b""
+        assert track.read_nibbles(3) == b""
+        assert not track.find((0xD5,))
+
+def test_track_with_no_1_bits():
+    track = wozardry.Track(bitarray.bitarray("0" * 16), 16)
+    assert track.cycle() == b""
+    assert track.read_nibbles(3) == b""
+
+def test_one_nibble_track():
+    track = wozardry.Track(bitarray.bitarray("11111111"), 8)
+    assert track.cycle() == b"\xFF"
+    assert track.read_nibbles(3) == b"\xFF\xFF\xFF"
+
+def open_mappings():
+    return [o for o in gc.get_objects() if isinstance(o, mmap.mmap) and not o.closed]
+
+def test_woz_load_leaves_no_mapping(tmp_path):
+    woz = wozardry.WozDiskImage()
+    woz.add_track(0, wozardry.Track(bitarray.bitarray("1111111100" * 5000, endian="big"), 50000))
+    path = tmp_path / "disk.woz"
+    path.write_bytes(bytes(woz))
+    with open(path, "rb") as f:
+        loaded = wozardry.WozDiskImage(f)
+    assert not open_mappings()
+    # replacing the source file (like Convert does) leaves the tracks intact
+    path.write_bytes(b"")
+    assert loaded.seek(0).bits == woz.seek(0).bits
+
+def test_edd_load_leaves_no_mapping(tmp_path):
+    path = tmp_path / "disk.edd"
+    path.write_bytes(b"\xFF" * 16384 * 137)
+    with open(path, "rb") as f:
+        eddimage.EDDReader(f)
+    assert not open_mappings()
+
+def test_bits_from_buffer():
+    image = memoryview(bytearray(b"\x00\xD5\xAA\x96\x00"))
+    assert wozardry.bits_from_buffer(image[1:4]) == bitarray.bitarray("110101011010101010010110")
+
+def test_find_weak_bits():
+    # sync, a stretch of 0s with stray 1 bits in it, and more sync (the
+    # weak bits start with the last 2 0 bits of the sync before them)
+    weak = "00000" + "1000000000000" + "100100000" + "0000"
+    bits = "1111111100" * 4 + weak + "1111111100" * 4
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    ranges = track.find_weak_bits((0xFF,), len(bits))
+    assert ranges == [(38, 40 + len(weak))]
+    # (it stops at the end of the track, leaving the nibble that starts
+    # there for the next read)
+    assert track.mark() == (0, 1)
+    assert track.zero_bits(ranges) == [(38, 2 + len(weak))]
+    assert track.bits == bitarray.bitarray("1111111100" * 4 + "0" * len(weak) + "1111111100" * 4)
+    assert track.zero_bits(ranges) == []
+
+def test_find_weak_bits_clean_track():
+    bits = "1111111100" * 8 + "11010101" + "10101010" + "10010110"
+    track = wozardry.Track(bitarray.bitarray(bits, endian="big"), len(bits))
+    assert track.find_weak_bits((0xFF, 0xD5, 0xAA, 0x96), len(bits)) == []